@@ -0,0 +1,118 @@
+import asyncio
+import time
+from metrics import metrics
+
+# Role and channel mutations are queued per guild instead of being awaited inline by
+# interaction handlers. Each guild's queue coalesces role changes (an add followed by a
+# remove of the same role collapses into whichever came last, and no-ops are skipped)
+# and runs independent actions concurrently, bounded per guild and overall so a burst
+# doesn't pile up on Discord's rate limit buckets.
+
+class GuildActionQueue:
+    def __init__(self, dispatcher, guild_id):
+        self.dispatcher = dispatcher
+        self.guild_id = guild_id
+        self.semaphore = asyncio.Semaphore(dispatcher.concurrency_per_guild)
+        self.role_changes = {}  # (member_id, role_id) -> (member, role, add)
+        self.pending = {}  # key -> (factory, future)
+        self.worker = None
+
+    def set_role(self, member, role, add):
+        self.role_changes[(member.id, role.id)] = (member, role, add)
+        self._wake()
+
+    def submit(self, factory, key=None):
+        # A later action with the same key replaces one that hasn't started yet
+        if key is None:
+            key = object()
+        previous = self.pending.pop(key, None)
+        if previous:
+            previous[1].cancel()
+        future = asyncio.get_running_loop().create_future()
+        # Fire-and-forget callers never look at the result; errors are logged in _call
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.pending[key] = (factory, future)
+        self._wake()
+        return future
+
+    def _wake(self):
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.role_changes or self.pending:
+                changes, self.role_changes = self.role_changes, {}
+                pending, self.pending = self.pending, {}
+
+                by_member = {}
+                for member, role, add in changes.values():
+                    _, adds, removes = by_member.setdefault(member.id, (member, [], []))
+                    (adds if add else removes).append(role)
+
+                jobs = [self._apply_roles(member, adds, removes) for member, adds, removes in by_member.values()]
+                jobs.extend(self._call(factory, future) for factory, future in pending.values())
+                await asyncio.gather(*jobs)
+        finally:
+            self.worker = None
+            self.dispatcher.queue_idle(self)
+
+    async def _limited(self, factory, call='action'):
+        async with self.semaphore, self.dispatcher.semaphore:
+            start = time.perf_counter()
+            try:
+                return await factory()
+            finally:
+                metrics.observe('discord_call_seconds', call, time.perf_counter() - start)
+
+    async def _apply_roles(self, member, adds, removes):
+        # Check against the cached member, which the gateway keeps up to date, so
+        # redundant changes never reach the API
+        current = member.guild.get_member(member.id) or member
+        adds = [role for role in adds if role not in current.roles]
+        removes = [role for role in removes if role in current.roles]
+        try:
+            if adds:
+                await self._limited(lambda: current.add_roles(*adds), 'add_roles')
+            if removes:
+                await self._limited(lambda: current.remove_roles(*removes), 'remove_roles')
+        except Exception as e:
+            print(f"Failed to update roles for member {member.id} in guild {self.guild_id}: {e}")
+
+    async def _call(self, factory, future):
+        if future.done():
+            return
+        try:
+            result = await self._limited(factory)
+        except Exception as e:
+            print(f"Queued action failed in guild {self.guild_id}: {e}")
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+class ActionDispatcher:
+    def __init__(self, concurrency_per_guild=4, concurrency=32):
+        self.concurrency_per_guild = concurrency_per_guild
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues = {}  # guild_id -> GuildActionQueue, only while it has work
+
+    def queue(self, guild_id):
+        queue = self.queues.get(guild_id)
+        if queue is None:
+            queue = self.queues[guild_id] = GuildActionQueue(self, guild_id)
+        return queue
+
+    def queue_idle(self, queue):
+        if not queue.role_changes and not queue.pending and self.queues.get(queue.guild_id) is queue:
+            del self.queues[queue.guild_id]
+
+    def add_role(self, member, role):
+        self.queue(member.guild.id).set_role(member, role, True)
+
+    def remove_role(self, member, role):
+        self.queue(member.guild.id).set_role(member, role, False)
+
+    def submit(self, guild_id, factory, key=None):
+        return self.queue(guild_id).submit(factory, key)
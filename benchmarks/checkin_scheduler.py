@@ -0,0 +1,103 @@
+# Holds thousands of pending check-in reminders in one DeadlineScheduler and reports
+# the memory each one costs, then lets a batch of short jittered schedules fire for a
+# few seconds to show how late reminders come due. Finally runs the Checkin cog's paced
+# sender with far more reminders coming due than it can send, to show the backlog stays
+# at one waiting reminder per user.
+#
+#   python -m benchmarks.checkin_scheduler [--users 1000 10000 100000] [--firing 5000] [--seconds 5]
+
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from cogs.checkin import Checkin, SENDS_PER_SECOND
+from models import CheckinSchedule
+from scheduler import DeadlineScheduler
+
+async def noop(key):
+    pass
+
+async def measure_memory(users):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    schedules = {}
+    scheduler = DeadlineScheduler(noop)
+    for user_id in range(users):
+        schedule = CheckinSchedule(1, user_id, 1, 1800, 5400)
+        schedules[(1, user_id)] = schedule
+        scheduler.schedule((1, user_id), schedule.next_deadline())
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"users={users:>7} pending={len(scheduler):>7} memory={used / 1024 / 1024:7.2f}MB ({used / users:.0f} bytes per reminder)")
+
+async def measure_firing(users, seconds):
+    schedules = {}
+    deadlines = {}
+    lags = []
+
+    async def on_due(key):
+        lags.append(time.monotonic() - deadlines[key])
+        deadlines[key] = schedules[key].next_deadline()
+        scheduler.schedule(key, deadlines[key])
+
+    scheduler = DeadlineScheduler(on_due)
+    for user_id in range(users):
+        # Windows of 0.5-1.5s so every reminder fires several times
+        schedule = schedules[(1, user_id)] = CheckinSchedule(1, user_id, 1, 0.5, 1.5)
+        deadlines[(1, user_id)] = schedule.next_deadline()
+        scheduler.schedule((1, user_id), deadlines[(1, user_id)])
+    scheduler.start()
+    cpu_start = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+    scheduler.stop()
+
+    lags.sort()
+    print(f"firing: {users} users, {len(lags)} reminders in {seconds}s (cpu {cpu:.2f}s)")
+    print(f"reminder lag ms: mean={statistics.mean(lags) * 1000:.2f} "
+          f"p99={lags[int(len(lags) * 0.99)] * 1000:.2f} max={lags[-1] * 1000:.2f}")
+
+class Channel:
+    def __init__(self):
+        self.sends = 0
+
+    async def send(self, content):
+        self.sends += 1
+
+class Bot:
+    def __init__(self):
+        self.channel = Channel()
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+async def measure_overload(users, seconds):
+    bot = Bot()
+    cog = Checkin(bot)
+    for user_id in range(users):
+        cog.add_schedule(CheckinSchedule(1, user_id, 1, 0.5, 1.5))
+    cog.scheduler.start()
+    sender = asyncio.create_task(cog.send_reminders())
+    backlog = 0
+    for _ in range(int(seconds * 10)):
+        await asyncio.sleep(0.1)
+        backlog = max(backlog, len(cog.reminders))
+    cog.scheduler.stop()
+    sender.cancel()
+    print(f"overload: {users} users due about every second, {bot.channel.sends} sent in {seconds}s "
+          f"(cap {SENDS_PER_SECOND}/s), largest backlog {backlog}")
+
+async def main(args):
+    for users in args.users:
+        await measure_memory(users)
+    await measure_firing(args.firing, args.seconds)
+    await measure_overload(args.firing, args.seconds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--firing', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+# Measures how late the event loop wakes up while the database is under write load.
+#
+#   python -m benchmarks.db_loop_lag [--writers 20] [--writes 200] [--blocking]
+#
+# --blocking runs the same writes with sqlite3 directly on the event loop, which is
+# how Database behaved before the dedicated database thread.
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from database import Database
+
+TICK = 0.005
+
+async def monitor_lag(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - start - TICK)
+
+async def write_load(db, writer_id, writes):
+    for i in range(writes):
+        await db.add_group_member(writer_id, i)
+        await db.log_vc_creation(1, writer_id, i, writer_id)
+
+async def blocking_write_load(conn, writer_id, writes):
+    for i in range(writes):
+        conn.execute('INSERT OR IGNORE INTO group_members (group_id, user_id) VALUES (?, ?)', (writer_id, i))
+        conn.commit()
+        conn.execute('INSERT INTO voice_channel_logs (guild_id, group_id, channel_id, creator_id, create_time) VALUES (1, ?, ?, ?, ?)',
+                     (writer_id, i, writer_id, time.time()))
+        conn.commit()
+        await asyncio.sleep(0)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.sqlite'))
+        await db.connect()
+
+        samples = []
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(monitor_lag(samples, stop))
+
+        start = time.perf_counter()
+        if args.blocking:
+            conn = sqlite3.connect(db.db_name)
+            await asyncio.gather(*(blocking_write_load(conn, w, args.writes) for w in range(args.writers)))
+            conn.close()
+        else:
+            await asyncio.gather(*(write_load(db, w, args.writes) for w in range(args.writers)))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await monitor
+        await db.close()
+
+    total = args.writers * args.writes * 2
+    mode = 'blocking' if args.blocking else 'database thread'
+    print(f"mode: {mode}")
+    print(f"writes: {total} in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+    print(f"loop lag ms: mean={statistics.mean(samples) * 1000:.2f} "
+          f"p99={percentile(samples, 99) * 1000:.2f} max={max(samples) * 1000:.2f} "
+          f"(samples={len(samples)})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=20)
+    parser.add_argument('--writes', type=int, default=200)
+    parser.add_argument('--blocking', action='store_true')
+    asyncio.run(main(parser.parse_args()))
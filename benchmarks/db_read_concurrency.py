@@ -0,0 +1,82 @@
+# Runs concurrent interactions that each do a few cheap reads (stats and task pages)
+# while a share of them run a leaderboard over a month of rollups, and compares read
+# throughput and cheap-read latency on reader connections against every call going
+# through the one write connection, as Database did before it had readers.
+#
+#   python -m benchmarks.db_read_concurrency [--concurrency 1 4 16 64] [--interactions 400] [--users 5000] [--readers 4]
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from database import Database, stats_day
+
+DAY = 86400
+
+async def seed(db, users):
+    now = time.time()
+    for day in range(30):
+        await db._execute_many('''
+        INSERT INTO stats_rollups (guild_id, scope, scope_id, day, focus_minutes, cycles)
+        VALUES (1, 'user', ?, ?, ?, 1)
+        ''', [(user_id, stats_day(now - day * DAY), random.randint(1, 120)) for user_id in range(users)])
+    for user_id in range(users):
+        await db._execute_many('INSERT INTO tasks (user_id, guild_id, description) VALUES (?, 1, ?)',
+                               [(user_id, f"task {i}") for i in range(5)])
+    await db.flush()
+
+async def interaction(db, users, heavy, latencies):
+    user_id = random.randrange(users)
+    since = stats_day(time.time() - 29 * DAY)
+    if heavy:
+        await db.get_leaderboard(1, 'focus_minutes', since)
+    start = time.perf_counter()
+    await db.get_stats(1, 'user', user_id, since)
+    await db.get_user_tasks(1, user_id)
+    latencies.append(time.perf_counter() - start)
+
+async def run(db, concurrency, args):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(number):
+        async with semaphore:
+            await interaction(db, args.users, number % 10 == 0, latencies)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(number) for number in range(args.interactions)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    reads = args.interactions * 2 + args.interactions // 10
+    return reads / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.sqlite'), readers=args.readers)
+        await db.connect()
+        await seed(db, args.users)
+        read = db._read
+
+        async def serialized(func, *call_args):
+            return await db._run(func, db.conn, *call_args)
+
+        for mode in ('serialized', 'readers'):
+            # serialized sends every read through the write connection and its lock
+            db._read = serialized if mode == 'serialized' else read
+            for concurrency in args.concurrency:
+                throughput, p50, p99 = await run(db, concurrency, args)
+                print(f"{mode:>10} concurrency={concurrency:>3} reads/s={throughput:7.0f} "
+                      f"cheap reads ms: p50={p50 * 1000:6.2f} p99={p99 * 1000:6.2f}")
+        await db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--interactions', type=int, default=400)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--readers', type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
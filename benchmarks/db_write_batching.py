@@ -0,0 +1,34 @@
+# Compares write throughput of a burst of concurrent writes (a mass join) with group
+# commit enabled against one commit per statement.
+#
+#   python -m benchmarks.db_write_batching [--members 2000] [--window 0.01] [--size 100]
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from database import Database
+
+async def burst(batch_window, batch_size, members):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.sqlite'), batch_window=batch_window, batch_size=batch_size)
+        await db.connect()
+        start = time.perf_counter()
+        await asyncio.gather(*(db.add_group_member(1, user_id) for user_id in range(members)))
+        elapsed = time.perf_counter() - start
+        await db.close()
+    return elapsed
+
+async def main(args):
+    for label, window, size in (('per-statement commit', 0, 1), ('group commit', args.window, args.size)):
+        elapsed = await burst(window, size, args.members)
+        print(f"{label}: {args.members} writes in {elapsed:.2f}s ({args.members / elapsed:.0f}/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--window', type=float, default=0.01)
+    parser.add_argument('--size', type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,76 @@
+# Fires the same-second burst of Pomodoro stage messages that sessions on the default
+# timings produce, against channels whose send() takes --latency seconds and which share
+# a global limit of --rate sends per second (Discord's is 50), and compares one send per
+# message with the NotificationDispatcher.
+#
+#   python -m benchmarks.notification_dispatch [--sessions 1000] [--channels 100] [--latency 0.05] [--rate 200] [--rounds 2]
+
+import argparse
+import asyncio
+import time
+
+from notifications import NotificationDispatcher
+
+class RateLimit:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_slot = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+class Channel:
+    def __init__(self, channel_id, latency, limit):
+        self.id = channel_id
+        self.latency = latency
+        self.limit = limit
+        self.sends = 0
+
+    async def send(self, content):
+        self.sends += 1
+        await self.limit.wait()
+        await asyncio.sleep(self.latency)
+
+async def direct(channels, sessions, rounds):
+    # What send_notification used to do: one awaited send per stage change
+    for stage in range(rounds):
+        await asyncio.gather(*(channels[session % len(channels)].send(f"group {session} stage {stage}")
+                               for session in range(sessions)))
+
+async def dispatched(channels, sessions, rounds):
+    dispatcher = NotificationDispatcher()
+    # Each round lands before the previous one has gone out, as when a backlog builds
+    for stage in range(rounds):
+        for session in range(sessions):
+            await dispatcher.notify(channels[session % len(channels)], ('pomodoro', session), f"group {session} stage {stage}")
+    while dispatcher.delivering:
+        await asyncio.sleep(0.01)
+    return dispatcher
+
+async def main(args):
+    limit = RateLimit(args.rate)
+    channels = [Channel(i, args.latency, limit) for i in range(args.channels)]
+    start = time.perf_counter()
+    await direct(channels, args.sessions, args.rounds)
+    elapsed = time.perf_counter() - start
+    print(f"direct:     {sum(c.sends for c in channels)} sends in {elapsed:.2f}s")
+
+    limit = RateLimit(args.rate)
+    channels = [Channel(i, args.latency, limit) for i in range(args.channels)]
+    start = time.perf_counter()
+    dispatcher = await dispatched(channels, args.sessions, args.rounds)
+    elapsed = time.perf_counter() - start
+    print(f"dispatcher: {sum(c.sends for c in channels)} sends in {elapsed:.2f}s "
+          f"(stale messages dropped: {dispatcher.dropped})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--rounds', type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
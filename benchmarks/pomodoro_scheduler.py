@@ -0,0 +1,49 @@
+# Runs thousands of concurrent Pomodoro sessions through one DeadlineScheduler and
+# reports how late stage transitions fire.
+#
+#   python -m benchmarks.pomodoro_scheduler [--sessions 10000] [--seconds 5]
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from cogs.pomodoro import PomodoroSession
+from scheduler import DeadlineScheduler
+
+async def main(args):
+    sessions = {}
+    lags = []
+
+    async def on_stage_end(group_id):
+        session = sessions[group_id]
+        lags.append(time.monotonic() - session.deadline)
+        session.advance()
+        scheduler.schedule(group_id, session.deadline)
+
+    scheduler = DeadlineScheduler(on_stage_end)
+    scheduler.start()
+    for group_id in range(args.sessions):
+        # Stage lengths in minutes, scaled down so every session cycles a few times
+        session = PomodoroSession(1, group_id, random.uniform(0.005, 0.02), 0.005, 0.01)
+        session.start()
+        sessions[group_id] = session
+        scheduler.schedule(group_id, session.deadline)
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(args.seconds)
+    cpu = time.process_time() - cpu_start
+    scheduler.stop()
+
+    lags.sort()
+    print(f"sessions: {args.sessions}, transitions: {len(lags)} in {args.seconds}s (cpu {cpu:.2f}s)")
+    print(f"transition lag ms: mean={statistics.mean(lags) * 1000:.2f} "
+          f"p99={lags[int(len(lags) * 0.99)] * 1000:.2f} max={lags[-1] * 1000:.2f}")
+    print(f"heap entries: {len(scheduler.heap)} for {len(scheduler)} pending deadlines")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
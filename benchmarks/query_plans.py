@@ -0,0 +1,110 @@
+# Runs every Database query against a scratch database and fails if any of them
+# falls back to a full table scan, or doesn't use the index it was written for.
+#
+#   python -m benchmarks.query_plans
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+from database import Database
+
+SKIPPED = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'CREATE', 'INSERT')
+
+# Statements containing the key must have a plan step containing the value
+EXPECTED_PLANS = {
+    'FROM stats_rollups INDEXED BY idx_stats_rollups_leaderboard': 'USING COVERING INDEX idx_stats_rollups_leaderboard',
+}
+
+async def exercise(db):
+    group_id = await db.create_study_group('bench', 1, 10, 0, 100)
+    await db.get_study_group(group_id)
+    await db.get_guild_study_groups(100)
+    await db.add_group_member(group_id, 1)
+    # Drop the cached guild so the lookup goes to the database
+    db.guild_states.discard(100)
+    await db.get_user_group(100, 1)
+    await db.get_group_members(group_id)
+    await db.remove_group_member(group_id, 1)
+    await db.update_group_roles(group_id, 2, 3)
+    await db.get_group_roles(group_id)
+    await db.update_voice_channel(group_id, 4)
+    await db.log_vc_creation(100, group_id, 4, 1)
+    await db.get_vc_logs(100, '2000-01-01')
+    await db.get_vc_logs(100, '2000-01-01', cursor=10)
+    session_id = await db.create_pomodoro_session(100, group_id, 25, 5, 15, 0)
+    await db.update_pomodoro_session(session_id, 'short_break', 1, 0, None)
+    await db.get_active_pomodoro_sessions()
+    await db.end_pomodoro_session(session_id)
+    await db.update_vc_cleanup_time(100, 60)
+    await db.get_vc_cleanup_time(100)
+    await db.update_vc_category(100, 5)
+    await db.get_vc_category(100)
+    await db.add_manager(1, 100, 2)
+    await db.get_manager(1, 100)
+    await db.get_all_managers(100)
+    await db.is_bot_developer(1)
+    await db.remove_manager(1, 100)
+    task_ids = await db.add_tasks(100, 1, ['bench', 'bench'])
+    await db.get_open_tasks(100, 1)
+    await db.complete_tasks(100, 1, task_ids)
+    await db.add_tasks(100, 1, ['bench'])
+    await db.complete_all_tasks(100, 1)
+    await db.get_user_tasks(100, 1)
+    await db.get_user_tasks(100, 1, cursor=10)
+    await db.set_checkin_schedule(100, 1, 5, 1800, 5400)
+    await db.add_checkins([(100, 1, 'bench', 0)])
+    await db.remove_checkin_schedule(100, 1)
+    await db.record_stats(100, group_id, [1, 2], focus_minutes=25, cycles=1)
+    await db.get_stats(100, 'user', 1, '2000-01-01')
+    await db.get_leaderboard(100, 'focus_minutes', '2000-01-01')
+    await db.get_expired_study_groups(0, 100)
+    await db.delete_study_group(group_id)
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'plans.sqlite'))
+        await db.connect()
+        statements = []
+        # Reads run on the reader connections, which aren't tied to a thread
+        readers = [db.readers.get() for _ in range(db.reader_count)]
+        for conn in readers:
+            conn.set_trace_callback(statements.append)
+            db.readers.put(conn)
+        await db._run(db.conn.set_trace_callback, statements.append)
+        await exercise(db)
+        await db._run(db.conn.set_trace_callback, None)
+        for conn in readers:
+            conn.set_trace_callback(None)
+        await db.close()
+
+        conn = sqlite3.connect(db.db_name)
+        # Scanning a partial index only visits the rows it covers (e.g. active sessions)
+        partial = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")}
+        failures = 0
+        seen = set()
+        for statement in statements:
+            statement = ' '.join(statement.split())
+            if statement.upper().startswith(SKIPPED) or statement in seen:
+                continue
+            seen.add(statement)
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}')]
+            scans = [step for step in plan if step.startswith('SCAN') and step.split()[-1] not in partial]
+            expected = [step for key, step in EXPECTED_PLANS.items() if key in statement]
+            missing = [step for step in expected if not any(step in actual for actual in plan)]
+            status = 'SCAN' if scans else 'INDEX' if missing else 'ok'
+            failures += bool(scans or missing)
+            print(f"[{status}] {statement}")
+            for step in plan:
+                print(f"    {step}")
+        conn.close()
+
+    if failures:
+        print(f"{failures} queries fall back to a table scan or miss their index")
+        sys.exit(1)
+    print("No query falls back to a table scan or misses its index")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+# Fetches a guild's study groups and a user's task history the way Database used to
+# (SELECT * into sqlite3.Row, read by name) and through its Query layer (the model's
+# columns into namedtuple rows), and reports the time per fetch-and-read and the
+# memory the fetched rows hold on to. Fetch times come out level within run-to-run
+# noise; the namedtuple rows keep roughly a quarter less memory, partly because they
+# hold only the columns their model needs.
+#
+#   python -m benchmarks.row_objects [--rows 5000] [--repeat 50]
+
+import argparse
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from database import Database, GUILD_STUDY_GROUPS, USER_TASKS, MIGRATIONS
+
+# Snowflake-sized IDs, so they cost what real ones do
+GUILD_ID = 1100000000000000000
+USER_ID = 1200000000000000000
+
+def seed(conn, rows):
+    for statements in MIGRATIONS:
+        for statement in statements:
+            conn.execute(statement)
+    conn.executemany('INSERT INTO study_groups (name, creator_id, max_size, end_time, guild_id) VALUES (?, ?, 10, 0, ?)',
+                     [(f"group {i}", USER_ID + i, GUILD_ID) for i in range(rows)])
+    conn.executemany('INSERT INTO tasks (user_id, guild_id, description) VALUES (?, ?, ?)',
+                     [(USER_ID, GUILD_ID, f"task number {i}") for i in range(rows)])
+    conn.commit()
+
+def fetch_rows(conn, rows):
+    conn.row_factory = sqlite3.Row
+    groups = conn.execute('SELECT * FROM study_groups WHERE guild_id = ?', (GUILD_ID,)).fetchall()
+    tasks = conn.execute('SELECT * FROM tasks WHERE user_id = ? AND guild_id = ? AND id > ? ORDER BY id LIMIT ?',
+                         (USER_ID, GUILD_ID, 0, rows)).fetchall()
+    for group in groups:
+        group['name'], group['voice_channel_id']
+    for task in tasks:
+        task['description'], task['completed']
+    return groups, tasks
+
+def fetch_models(conn, rows):
+    conn.row_factory = None
+    groups = Database._query_sync(conn, GUILD_STUDY_GROUPS, (GUILD_ID,)).fetchall()
+    tasks = Database._query_sync(conn, USER_TASKS, (USER_ID, GUILD_ID, 0, rows)).fetchall()
+    for group in groups:
+        group.name, group.voice_channel_id
+    for task in tasks:
+        task.description, task.completed
+    return groups, tasks
+
+def measure(label, fetch, conn, args):
+    fetch(conn, args.rows)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        fetch(conn, args.rows)
+    elapsed = (time.perf_counter() - start) / args.repeat
+
+    # A full collection also empties CPython's free lists. Without it, the tuples sqlite3
+    # builds before the row factory runs still count as held, which at small fetches made
+    # the namedtuple rows look bigger than sqlite3.Row.
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = fetch(conn, args.rows)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    count = sum(len(rows) for rows in kept)
+    print(f"{label:>12}: {elapsed * 1000:7.2f}ms per fetch of {count} rows, {used / count:5.0f} bytes per row kept")
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.sqlite'))
+        seed(conn, args.rows)
+        measure('sqlite3.Row', fetch_rows, conn, args)
+        measure('Query', fetch_models, conn, args)
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    main(parser.parse_args())
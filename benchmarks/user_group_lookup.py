@@ -0,0 +1,55 @@
+# Measures get_user_group as the number of study groups in one guild grows, both
+# against the cached guild state and straight from the database.
+#
+#   python -m benchmarks.user_group_lookup [--groups 100 1000 10000] [--members 5] [--lookups 2000]
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from database import Database
+
+GUILD_ID = 100
+
+async def populate(db, groups, members):
+    async def create(group_id):
+        created = await db.create_study_group(f'group {group_id}', group_id, members, 0.0, GUILD_ID)
+        await db.add_group_members(created, [group_id * members + m for m in range(members)])
+    await asyncio.gather(*(create(group_id) for group_id in range(groups)))
+
+async def time_lookups(db, user_ids, cached):
+    start = time.perf_counter()
+    for user_id in user_ids:
+        if not cached:
+            db.guild_states.discard(GUILD_ID)
+        group = await db.get_user_group(GUILD_ID, user_id)
+        assert group is not None and user_id in group.members
+    return (time.perf_counter() - start) / len(user_ids)
+
+async def run(groups, members, lookups):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.sqlite'))
+        await db.connect()
+        await populate(db, groups, members)
+        user_ids = [random.randrange(groups * members) for _ in range(lookups)]
+
+        await db.get_guild_state(GUILD_ID)
+        cached = await time_lookups(db, user_ids, True)
+        uncached = await time_lookups(db, user_ids[:max(1, lookups // 20)], False)
+        await db.close()
+
+    print(f"groups={groups:>6} cached={cached * 1e6:8.2f}us  cold={uncached * 1e3:8.2f}ms (includes loading the guild)")
+
+async def main(args):
+    for groups in args.groups:
+        await run(groups, args.members, args.lookups)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--members', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
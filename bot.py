@@ -1,11 +1,31 @@
 import os
+import argparse
+import asyncio
+import hashlib
+import json
+import time
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 from database import Database
+from actions import ActionDispatcher
+from notifications import NotificationDispatcher
+from metrics import metrics, start_metrics_server
+from utils import UserResolver
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
+# Set to sync commands to a single test guild, where changes show up immediately
+DEV_GUILD_ID = os.getenv('DEV_GUILD_ID')
+TREE_HASH_FILE = '.command_tree_hash.json'
+# Set to serve Prometheus-format metrics on http://127.0.0.1:<port>/metrics
+METRICS_PORT = os.getenv('METRICS_PORT')
+# Cogs load stage by stage, and the cogs within a stage load concurrently. Manager goes
+# first because the permission checks in utils look it up; every cog not listed here
+# loads in a final stage.
+COG_STAGES = [
+    ['manager'],
+]
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -13,33 +33,120 @@ intents.members = True
 intents.guilds = True
 intents.voice_states = True
 
-class CPO(commands.Bot):
-    def __init__(self):
-        super().__init__(command_prefix='!', intents=intents)
-        self.db = Database()
+def parse_args():
+    # SHARD_COUNT/SHARD_IDS (or --shard-count/--shard-ids) split the bot across processes,
+    # e.g. SHARD_COUNT=4 SHARD_IDS=0,1 here and SHARD_IDS=2,3 elsewhere. Left unset, one
+    # process runs every shard and discord.py picks the count.
+    env_ids = os.getenv('SHARD_IDS')
+    parser = argparse.ArgumentParser(description="Run the CPO bot")
+    parser.add_argument('--shard-count', type=int, default=os.getenv('SHARD_COUNT'))
+    parser.add_argument('--shard-ids', type=int, nargs='+',
+                        default=[int(shard_id) for shard_id in env_ids.split(',')] if env_ids else None)
+    parser.add_argument('--sync', action='store_true', help="sync slash commands even if they haven't changed")
+    args, _ = parser.parse_known_args()
+    if args.shard_ids is not None and args.shard_count is None:
+        parser.error("--shard-ids needs --shard-count")
+    return args
+
+class CPO(commands.AutoShardedBot):
+    def __init__(self, shard_count=None, shard_ids=None, dev_guild_id=None, force_sync=False):
+        super().__init__(command_prefix='!', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+        self.db = Database(shard_count=shard_count, shard_ids=shard_ids)
+        self.dev_guild_id = int(dev_guild_id) if dev_guild_id else None
+        self.force_sync = force_sync
+        self.actions = ActionDispatcher()
+        self.notifications = NotificationDispatcher()
+        self.metrics_server = None
+        self.user_resolver = UserResolver(self)
 
     async def setup_hook(self):
+        start = phase = time.perf_counter()
+        if METRICS_PORT:
+            self.metrics_server = await start_metrics_server(int(METRICS_PORT))
         await self.db.connect()
-        for filename in os.listdir("./cogs"):
-            if filename.endswith(".py") and not filename.startswith("_"):
-                try:
-                    await self.load_extension(f"cogs.{filename[:-3]}")
-                    print(f"Loaded extension: {filename[:-3]}")
-                except Exception as e:
-                    print(f"Failed to load extension {filename[:-3]}: {e}")
-        await self.tree.sync()
-        print("CPO setup completed.")
+        print(f"Database connected in {time.perf_counter() - phase:.2f}s")
+
+        # Cache warmup only reads the database, so it overlaps with loading the cogs
+        await asyncio.gather(self.warm_up(), self.load_cogs())
+
+        phase = time.perf_counter()
+        synced = await self.sync_commands()
+        print(f"Command sync {'done' if synced else 'skipped, tree unchanged'} in {time.perf_counter() - phase:.2f}s")
+        print(f"CPO setup completed in {time.perf_counter() - start:.2f}s.")
+
+    async def warm_up(self):
+        start = time.perf_counter()
+        await self.db.warm_up()
+        print(f"Caches warmed in {time.perf_counter() - start:.2f}s")
+
+    async def load_cogs(self):
+        start = time.perf_counter()
+        names = sorted(filename[:-3] for filename in os.listdir("./cogs") if filename.endswith(".py") and not filename.startswith("_"))
+        stages = [[name for name in stage if name in names] for stage in COG_STAGES]
+        staged = {name for stage in stages for name in stage}
+        stages.append([name for name in names if name not in staged])
+        for stage in stages:
+            await asyncio.gather(*(self.load_cog(name) for name in stage))
+        print(f"Cogs loaded in {time.perf_counter() - start:.2f}s")
+
+    async def load_cog(self, name):
+        start = time.perf_counter()
+        try:
+            await self.load_extension(f"cogs.{name}")
+            print(f"Loaded extension: {name} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+        except Exception as e:
+            print(f"Failed to load extension {name}: {e}")
+
+    async def sync_commands(self):
+        # A global sync is a heavily rate limited call, so it only happens when the
+        # serialized command tree differs from the one last synced from this machine
+        guild = discord.Object(self.dev_guild_id) if self.dev_guild_id else None
+        if guild:
+            self.tree.copy_global_to(guild=guild)
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        scope = f"{self.application_id}:{self.dev_guild_id or 'global'}"
+
+        try:
+            with open(TREE_HASH_FILE) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+        if not self.force_sync and hashes.get(scope) == digest:
+            return False
+
+        await self.tree.sync(guild=guild)
+        hashes[scope] = digest
+        with open(TREE_HASH_FILE, 'w') as f:
+            json.dump(hashes, f)
+        return True
 
     async def on_ready(self):
         print(f'{self.user} has connected to Discord!')
+        print(f"Shards: {sorted(self.shards)} of {self.shard_count}")
+        # Without SHARD_COUNT the count is only known now, from the gateway
+        self.db.guild_states.repartition(self.shard_count)
         print(f"Guilds: {len(self.guilds)}")
-        print(f"Users: {len(set(self.get_all_members()))}")
+        # Members in several guilds are counted once per guild, but this doesn't walk every member
+        print(f"Members: {sum(guild.member_count or 0 for guild in self.guilds)}")
+
+    async def on_socket_event_type(self, event_type):
+        metrics.increment('gateway_events_total', event_type)
+
+    async def on_app_command_completion(self, interaction, command):
+        metrics.observe('command_seconds', command.qualified_name, (discord.utils.utcnow() - interaction.created_at).total_seconds())
 
     async def close(self):
-        await self.db.close()
+        # Cogs unload first, since unloading can still write (buffered check-ins); then
+        # anything left in the write queue is committed before the connection goes away
         await super().close()
+        await self.db.flush()
+        await self.db.close()
+        if self.metrics_server:
+            await self.metrics_server.cleanup()
 
-cpo = CPO()
+args = parse_args()
+cpo = CPO(args.shard_count, args.shard_ids, DEV_GUILD_ID, args.sync)
 
 @cpo.event
 async def on_command_error(ctx, error):
@@ -55,13 +162,18 @@ async def on_command_error(ctx, error):
 
 @cpo.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
+    command = interaction.command.qualified_name if interaction.command else 'unknown'
+    metrics.increment('command_errors_total', command)
+    metrics.observe('command_seconds', command, (discord.utils.utcnow() - interaction.created_at).total_seconds())
+    # The command may already have replied (or deferred) before it failed
+    send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
     if isinstance(error, discord.app_commands.CommandOnCooldown):
-        await interaction.response.send_message(f"This command is on cooldown. Try again in {error.retry_after:.2f} seconds.", ephemeral=True)
-    elif isinstance(error, discord.app_commands.MissingPermissions):
-        await interaction.response.send_message("You don't have the required permissions to use this command.", ephemeral=True)
+        await send(f"This command is on cooldown. Try again in {error.retry_after:.2f} seconds.", ephemeral=True)
+    elif isinstance(error, (discord.app_commands.MissingPermissions, discord.app_commands.CheckFailure)):
+        await send("You don't have the required permissions to use this command.", ephemeral=True)
     else:
         print(f"An error occurred in app command: {error}")
-        await interaction.response.send_message("An error occurred while processing the command.", ephemeral=True)
+        await send("An error occurred while processing the command.", ephemeral=True)
 
 if __name__ == "__main__":
     cpo.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,280 @@
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+# In-memory copies of hot database state. Database fills these (up front, or on first
+# use for guild state) and updates them after each write commits, so lookups don't
+# have to touch SQLite.
+
+def shard_for(guild_id, shard_count):
+    # The shard Discord delivers a guild's events on
+    return (guild_id >> 22) % shard_count
+
+class PermissionCache:
+    def __init__(self):
+        self.managers = {}  # (guild_id, user_id) -> permission_level
+        self.bot_developers = set()  # managers rows with a NULL guild_id
+
+    def load(self, rows):
+        self.managers.clear()
+        self.bot_developers.clear()
+        for row in rows:
+            self.set(row.user_id, row.guild_id, row.permission_level)
+
+    def set(self, user_id, guild_id, permission_level):
+        if guild_id is None:
+            self.bot_developers.add(user_id)
+        else:
+            self.managers[(guild_id, user_id)] = permission_level
+
+    def remove(self, user_id, guild_id):
+        self.managers.pop((guild_id, user_id), None)
+
+    def is_bot_developer(self, user_id):
+        if user_id in self.bot_developers:
+            metrics.increment('cache_hits_total', 'permissions')
+            return True
+        return False
+
+    def get_level(self, guild_id, user_id):
+        level = self.managers.get((guild_id, user_id))
+        if level is None:
+            metrics.increment('cache_misses_total', 'permissions')
+        else:
+            metrics.increment('cache_hits_total', 'permissions')
+        return level
+
+class GroupState:
+    __slots__ = ('id', 'name', 'creator_id', 'max_size', 'end_time', 'guild_id',
+                 'admin_role_id', 'session_role_id', 'voice_channel_id', 'members')
+
+    def __init__(self, group, members=()):
+        # group is a StudyGroup row; this is its mutable, cached counterpart
+        self.id = group.id
+        self.name = group.name
+        self.creator_id = group.creator_id
+        self.max_size = group.max_size
+        self.end_time = group.end_time
+        self.guild_id = group.guild_id
+        self.admin_role_id = group.admin_role_id
+        self.session_role_id = group.session_role_id
+        self.voice_channel_id = group.voice_channel_id
+        self.members = set(members)
+
+class GuildState:
+    __slots__ = ('guild_id', 'groups', 'user_groups', 'vc_cleanup_time', 'vc_category_id')
+
+    def __init__(self, guild_id, groups=(), vc_cleanup_time=600, vc_category_id=None):
+        self.guild_id = guild_id
+        self.groups = {}  # group_id -> GroupState
+        self.user_groups = {}  # user_id -> group_id; users are in at most one group per guild
+        self.vc_cleanup_time = vc_cleanup_time
+        self.vc_category_id = vc_category_id
+        for group in groups:
+            self.add_group(group)
+
+    def add_group(self, group):
+        self.groups[group.id] = group
+        for user_id in group.members:
+            self.user_groups[user_id] = group.id
+
+    def remove_group(self, group):
+        self.groups.pop(group.id, None)
+        for user_id in group.members:
+            if self.user_groups.get(user_id) == group.id:
+                del self.user_groups[user_id]
+
+    def claim(self, group, user_id):
+        # Seats a user before their insert commits, so concurrent joins see the group as
+        # fuller and the user as taken; the commit then finds them already there
+        group.members.add(user_id)
+        self.user_groups[user_id] = group.id
+
+    def release(self, group, user_id):
+        # Undoes claim when the insert fails
+        group.members.discard(user_id)
+        if self.user_groups.get(user_id) == group.id:
+            del self.user_groups[user_id]
+
+    def user_group(self, user_id):
+        group_id = self.user_groups.get(user_id)
+        return self.groups.get(group_id) if group_id is not None else None
+
+    def find_group(self, name):
+        name = name.casefold()
+        for group in self.groups.values():
+            if group.name.casefold() == name:
+                return group
+        return None
+
+class GuildStateCache:
+    # One LRU partition per shard, each holding up to max_guilds guilds, so a busy shard
+    # can't evict every other shard's guilds
+    def __init__(self, max_guilds=5000, shard_count=1):
+        self.max_guilds = max_guilds
+        self.shard_count = shard_count
+        self.partitions = [OrderedDict() for _ in range(shard_count)]  # guild_id -> GuildState, least recently used first
+        self.groups = {}  # group_id -> GroupState, for every cached guild
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions)
+
+    def repartition(self, shard_count):
+        # An auto-sharded bot only learns its shard count from the gateway, after the
+        # cache was created with one partition
+        if shard_count == self.shard_count:
+            return
+        states = [state for partition in self.partitions for state in partition.values()]
+        self.shard_count = shard_count
+        self.partitions = [OrderedDict() for _ in range(shard_count)]
+        for state in states:
+            self.partition(state.guild_id)[state.guild_id] = state
+
+    def partition(self, guild_id):
+        return self.partitions[shard_for(guild_id, self.shard_count)]
+
+    def get(self, guild_id):
+        guilds = self.partition(guild_id)
+        state = guilds.get(guild_id)
+        if state is None:
+            metrics.increment('cache_misses_total', 'guild_state')
+            return None
+        metrics.increment('cache_hits_total', 'guild_state')
+        guilds.move_to_end(guild_id)
+        return state
+
+    def peek(self, guild_id):
+        return self.partition(guild_id).get(guild_id)
+
+    def get_group(self, group_id):
+        return self.groups.get(group_id)
+
+    def put(self, state):
+        self.discard(state.guild_id)
+        guilds = self.partition(state.guild_id)
+        guilds[state.guild_id] = state
+        self.groups.update(state.groups)
+        while len(guilds) > self.max_guilds:
+            _, evicted = guilds.popitem(last=False)
+            for group_id in evicted.groups:
+                self.groups.pop(group_id, None)
+
+    def discard(self, guild_id):
+        state = self.partition(guild_id).pop(guild_id, None)
+        if state:
+            for group_id in state.groups:
+                self.groups.pop(group_id, None)
+
+    def add_group(self, group):
+        state = self.peek(group.guild_id)
+        if state is None:
+            return
+        state.add_group(group)
+        self.groups[group.id] = group
+
+    def remove_group(self, group_id):
+        group = self.groups.pop(group_id, None)
+        if group:
+            state = self.peek(group.guild_id)
+            if state:
+                state.remove_group(group)
+
+    def add_members(self, group_id, user_ids):
+        group = self.groups.get(group_id)
+        if group is None:
+            return
+        state = self.peek(group.guild_id)
+        for user_id in user_ids:
+            group.members.add(user_id)
+            state.user_groups[user_id] = group_id
+
+    def remove_member(self, group_id, user_id):
+        group = self.groups.get(group_id)
+        if group is None:
+            return
+        group.members.discard(user_id)
+        state = self.peek(group.guild_id)
+        if state.user_groups.get(user_id) == group_id:
+            del state.user_groups[user_id]
+
+class VoiceChannelIndex:
+    def __init__(self):
+        self.channels = {}  # voice_channel_id -> group_id
+        self.groups = {}  # group_id -> voice_channel_id
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels
+
+    def load(self, rows):
+        self.channels.clear()
+        self.groups.clear()
+        for row in rows:
+            self.set(row.id, row.voice_channel_id)
+
+    def get_group_id(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def set(self, group_id, channel_id):
+        self.remove_group(group_id)
+        if channel_id is not None:
+            self.channels[channel_id] = group_id
+            self.groups[group_id] = channel_id
+
+    def remove_group(self, group_id):
+        channel_id = self.groups.pop(group_id, None)
+        if channel_id is not None:
+            self.channels.pop(channel_id, None)
+
+class OpenTaskCache:
+    # Open tasks of recently active users; the least recently used are evicted first
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        self.users = OrderedDict()  # (guild_id, user_id) -> {task_id: description}, oldest task first
+
+    def get(self, guild_id, user_id):
+        tasks = self.users.get((guild_id, user_id))
+        if tasks is None:
+            metrics.increment('cache_misses_total', 'open_tasks')
+            return None
+        metrics.increment('cache_hits_total', 'open_tasks')
+        self.users.move_to_end((guild_id, user_id))
+        return tasks
+
+    def put(self, guild_id, user_id, tasks):
+        self.users[(guild_id, user_id)] = tasks
+        self.users.move_to_end((guild_id, user_id))
+        while len(self.users) > self.max_users:
+            self.users.popitem(last=False)
+
+    def add(self, guild_id, user_id, tasks):
+        cached = self.users.get((guild_id, user_id))
+        if cached is not None:
+            cached.update(tasks)
+
+    def remove(self, guild_id, user_id, task_ids):
+        cached = self.users.get((guild_id, user_id))
+        if cached is not None:
+            for task_id in task_ids:
+                cached.pop(task_id, None)
+
+class TTLCache:
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at), oldest first
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
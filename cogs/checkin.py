@@ -0,0 +1,138 @@
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+import asyncio
+import time
+from metrics import metrics
+from models import CheckinSchedule
+from scheduler import DeadlineScheduler
+from utils import parse_duration
+
+# Reminder messages sent per second at most, across all guilds, which caps delivery at
+# 18,000 reminders an hour. Past that, reminders wait in line, but each user only ever
+# has one waiting: a reminder that comes due while the last one is unsent is dropped.
+SENDS_PER_SECOND = 5
+FLUSH_INTERVAL = 5  # seconds between writes of buffered check-ins
+FLUSH_SIZE = 200  # buffered check-ins that trigger a write straight away
+MAX_RESPONSE_LENGTH = 1000
+
+class Checkin(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.schedules = {}  # (guild_id, user_id) -> CheckinSchedule
+        # Every user's next reminder sits in this one heap; there is no task per user
+        self.scheduler = DeadlineScheduler(self.on_reminder_due, 'checkin')
+        self.reminders = {}  # (guild_id, user_id) -> None, in the order they came due
+        self.reminders_waiting = asyncio.Event()
+        self.sender = None
+        self.pending_checkins = []
+
+    async def cog_load(self):
+        for schedule in await self.bot.db.get_checkin_schedules():
+            self.add_schedule(schedule)
+        if self.schedules:
+            print(f"Restored {len(self.schedules)} check-in schedules")
+        self.scheduler.start()
+        self.sender = asyncio.create_task(self.send_reminders())
+        self.flush_checkins.start()
+
+    async def cog_unload(self):
+        self.scheduler.stop()
+        if self.sender:
+            self.sender.cancel()
+        self.flush_checkins.cancel()
+        await self.write_checkins()
+
+    def add_schedule(self, schedule):
+        key = (schedule.guild_id, schedule.user_id)
+        self.schedules[key] = schedule
+        self.scheduler.schedule(key, schedule.next_deadline())
+
+    async def on_reminder_due(self, key):
+        schedule = self.schedules.get(key)
+        if schedule is None:
+            return
+        self.scheduler.schedule(key, schedule.next_deadline())
+        if key in self.reminders:
+            metrics.increment('checkin_reminders_total', 'coalesced')
+            return
+        self.reminders[key] = None
+        self.reminders_waiting.set()
+
+    async def send_reminders(self):
+        # Reminders that come due together are sent at a steady pace instead of in a burst
+        while True:
+            if not self.reminders:
+                self.reminders_waiting.clear()
+                await self.reminders_waiting.wait()
+                continue
+            key = next(iter(self.reminders))
+            del self.reminders[key]
+            # The user may have stopped, or restarted in another channel, since it came due
+            schedule = self.schedules.get(key)
+            if schedule is None:
+                continue
+            metrics.increment('checkin_reminders_total', 'sent')
+            channel = self.bot.get_channel(schedule.channel_id)
+            if channel:
+                try:
+                    await channel.send(f"<@{schedule.user_id}> Time to check in! What are you working on? Reply with /checkin.")
+                except Exception as e:
+                    print(f"Failed to send check-in reminder in channel {schedule.channel_id}: {e}")
+            await asyncio.sleep(1 / SENDS_PER_SECOND)
+
+    @app_commands.command(name="start_checkin", description="Get reminded to check in at random intervals")
+    @app_commands.guild_only()
+    @app_commands.describe(min_interval="Shortest time between reminders, e.g. 30m", max_interval="Longest time between reminders, e.g. 90m")
+    async def start_checkin(self, interaction: discord.Interaction, min_interval: str = "30m", max_interval: str = "90m"):
+        shortest = parse_duration(min_interval)
+        longest = parse_duration(max_interval)
+        if shortest is None or longest is None:
+            await interaction.response.send_message("Invalid duration. Use a format like `30m` or `2h`.", ephemeral=True)
+            return
+        if shortest < 300 or longest < shortest:
+            await interaction.response.send_message("Reminders need at least 5 minutes between them, and the maximum can't be below the minimum.", ephemeral=True)
+            return
+
+        schedule = CheckinSchedule(interaction.guild_id, interaction.user.id, interaction.channel_id, shortest, longest)
+        await self.bot.db.set_checkin_schedule(schedule.guild_id, schedule.user_id, schedule.channel_id, shortest, longest)
+        self.add_schedule(schedule)
+        await interaction.response.send_message(
+            f"Check-in reminders started. You'll be pinged in this channel every {min_interval} to {max_interval}.", ephemeral=True)
+
+    @app_commands.command(name="stop_checkin", description="Stop your check-in reminders")
+    @app_commands.guild_only()
+    async def stop_checkin(self, interaction: discord.Interaction):
+        key = (interaction.guild_id, interaction.user.id)
+        self.schedules.pop(key, None)
+        self.scheduler.cancel(key)
+        if await self.bot.db.remove_checkin_schedule(*key):
+            await interaction.response.send_message("Check-in reminders stopped.", ephemeral=True)
+        else:
+            await interaction.response.send_message("You don't have check-in reminders running.", ephemeral=True)
+
+    @app_commands.command(name="checkin", description="Post a check-in about what you're working on")
+    @app_commands.guild_only()
+    @app_commands.describe(update="What you've done or are working on")
+    async def checkin(self, interaction: discord.Interaction, update: str):
+        self.pending_checkins.append((interaction.guild_id, interaction.user.id, update[:MAX_RESPONSE_LENGTH], time.time()))
+        await interaction.response.send_message(f"{interaction.user.mention} checked in: {update[:MAX_RESPONSE_LENGTH]}")
+        if len(self.pending_checkins) >= FLUSH_SIZE:
+            await self.write_checkins()
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush_checkins(self):
+        await self.write_checkins()
+
+    async def write_checkins(self):
+        # Check-ins are buffered and inserted together rather than one write per command
+        if not self.pending_checkins:
+            return
+        checkins, self.pending_checkins = self.pending_checkins, []
+        try:
+            await self.bot.db.add_checkins(checkins)
+        except Exception as e:
+            print(f"Failed to save {len(checkins)} check-ins: {e}")
+
+async def setup(bot):
+    await bot.add_cog(Checkin(bot))
@@ -1,6 +1,11 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+from utils import EmbedPaginator, is_manager
+from metrics import metrics
+
+MANAGERS_PER_PAGE = 10
+PERF_ROWS = 8  # slowest labels shown per metric in /perf
 
 class PermissionLevel:
     BOT_DEVELOPER = 3
@@ -9,14 +14,18 @@ class PermissionLevel:
     REGULAR_USER = 0
 
 class Manager(commands.Cog):
+    PermissionLevel = PermissionLevel
+
     def __init__(self, bot):
         self.bot = bot
 
     async def get_permission_level(self, guild_id, user_id):
-        manager = await self.bot.db.get_manager(user_id, guild_id)
-        if manager:
-            return manager[3]  # permission_level
-        return PermissionLevel.REGULAR_USER
+        # Served from the managers table preloaded by Database; only bot developers added
+        # by another shard process since then need a query
+        if await self.bot.db.is_bot_developer(user_id):
+            return PermissionLevel.BOT_DEVELOPER
+        level = self.bot.db.permissions.get_level(guild_id, user_id)
+        return level if level is not None else PermissionLevel.REGULAR_USER
 
     @app_commands.command(name="add_bot_developer", description="Add a bot developer (Bot Developer only)")
     @app_commands.describe(user="The user to add as a bot developer")
@@ -50,19 +59,58 @@ class Manager(commands.Cog):
 
     @app_commands.command(name="list_managers", description="List all managers for this server")
     async def list_managers(self, interaction: discord.Interaction):
+        # Resolving users that aren't cached can take longer than the interaction deadline
+        await interaction.response.defer()
         managers = await self.bot.db.get_all_managers(interaction.guild_id)
-        
-        embed = discord.Embed(title="Managers", color=discord.Color.blue())
-        for manager in managers:
-            user = await self.bot.fetch_user(manager[1])  # user_id
-            level = "Bot Developer" if manager[2] is None else "Guild Manager"
-            embed.add_field(name=f"{user.name}#{user.discriminator}", value=level, inline=False)
+        users = await self.bot.user_resolver.resolve(interaction.guild, [manager.user_id for manager in managers])
+
+        pages = []
+        for start in range(0, max(len(managers), 1), MANAGERS_PER_PAGE):
+            embed = discord.Embed(title="Managers", color=discord.Color.blue())
+            for manager in managers[start:start + MANAGERS_PER_PAGE]:
+                user = users.get(manager.user_id)
+                name = f"{user.name}#{user.discriminator}" if user else f"Unknown user ({manager.user_id})"
+                level = "Bot Developer" if manager.guild_id is None else "Guild Manager"
+                embed.add_field(name=name, value=level, inline=False)
+            pages.append(embed)
+
+        if len(pages) == 1:
+            await interaction.followup.send(embed=pages[0])
+            return
+
+        for number, page in enumerate(pages, start=1):
+            page.set_footer(text=f"Page {number}/{len(pages)}")
+        await interaction.followup.send(embed=pages[0], view=EmbedPaginator(interaction.user.id, pages))
+
+    @app_commands.command(name="perf", description="Show latency of the bot's hot paths since it started (Manager only)")
+    @is_manager()
+    async def perf(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="Performance", color=discord.Color.blue())
+        for name, title in (('command_seconds', "Commands"), ('db_call_seconds', "Database calls"),
+                            ('db_wait_seconds', "Database queueing"), ('scheduler_lag_seconds', "Scheduler lag"),
+                            ('discord_call_seconds', "Discord calls")):
+            rows = metrics.summary(name, PERF_ROWS)
+            lines = [f"{label[:22]:<22} {count:>7} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f}" for label, count, p50, p99 in rows]
+            table = "\n".join([f"{'':<22} {'count':>7} {'p50 ms':>8} {'p99 ms':>8}"] + lines) if lines else "No data yet"
+            embed.add_field(name=title, value=f"```\n{table}\n```", inline=False)
+
+        for name, title in (('gateway_events_total', "Gateway events"), ('voice_events_total', "Voice state updates")):
+            counts = sorted(metrics.counters[name].items(), key=lambda item: item[1], reverse=True)[:PERF_ROWS]
+            if counts:
+                table = "\n".join(f"{label[:30]:<30} {count:>10}" for label, count in counts)
+                embed.add_field(name=title, value=f"```\n{table}\n```", inline=False)
 
-        await interaction.response.send_message(embed=embed)
+        hits, misses = metrics.counters['cache_hits_total'], metrics.counters['cache_misses_total']
+        caches = sorted(set(hits) | set(misses))
+        if caches:
+            lines = [f"{cache[:22]:<22} {hits.get(cache, 0):>10} {misses.get(cache, 0):>10}" for cache in caches]
+            table = "\n".join([f"{'':<22} {'hits':>10} {'misses':>10}"] + lines)
+            embed.add_field(name="Caches", value=f"```\n{table}\n```", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     async def is_group_creator(self, guild_id, user_id):
-        group = await self.bot.db.get_study_group(guild_id)
-        return group and group[2] == user_id  # Assuming creator_id is at index 2
+        group = await self.bot.db.get_user_group(guild_id, user_id)
+        return group is not None and group.creator_id == user_id
 
 async def setup(bot):
     await bot.add_cog(Manager(bot))
\ No newline at end of file
@@ -1,11 +1,16 @@
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
-import asyncio
-from datetime import datetime, timedelta
+from discord.ext import commands
+import time
+from scheduler import DeadlineScheduler
 
 class PomodoroSession:
-    def __init__(self, group_id, focus, short_break, long_break):
+    __slots__ = ('session_id', 'guild_id', 'group_id', 'focus', 'short_break', 'long_break',
+                 'current_stage', 'cycles', 'is_paused', 'deadline', 'paused_remaining')
+
+    def __init__(self, guild_id, group_id, focus, short_break, long_break):
+        self.session_id = None
+        self.guild_id = guild_id
         self.group_id = group_id
         self.focus = focus
         self.short_break = short_break
@@ -13,12 +18,109 @@ class PomodoroSession:
         self.current_stage = "focus"
         self.cycles = 0
         self.is_paused = False
-        self.timer = None
+        self.deadline = None  # time.monotonic() at which the current stage ends
+        self.paused_remaining = None
+
+    @classmethod
+    def from_row(cls, row):
+        # row is a PomodoroSessionRecord
+        session = cls(row.guild_id, row.group_id, row.focus_duration, row.short_break_duration, row.long_break_duration)
+        session.session_id = row.id
+        session.current_stage = row.stage
+        session.cycles = row.cycles
+        if row.paused_remaining is not None:
+            session.is_paused = True
+            session.paused_remaining = row.paused_remaining
+        else:
+            # Monotonic clocks don't survive a restart, so the deadline is stored as wall-clock time
+            session.deadline = time.monotonic() + (row.stage_deadline - time.time())
+        return session
+
+    def stage_deadline(self):
+        if self.is_paused:
+            return None
+        return time.time() + self.remaining()
+
+    def stage_length(self):
+        minutes = {"focus": self.focus, "short_break": self.short_break, "long_break": self.long_break}
+        return minutes[self.current_stage] * 60
+
+    def start(self):
+        self.deadline = time.monotonic() + self.stage_length()
+
+    def remaining(self):
+        if self.is_paused:
+            return self.paused_remaining
+        return max(0.0, self.deadline - time.monotonic())
+
+    def pause(self):
+        self.paused_remaining = self.remaining()
+        self.is_paused = True
+
+    def resume(self):
+        self.deadline = time.monotonic() + self.paused_remaining
+        self.paused_remaining = None
+        self.is_paused = False
+
+    def advance(self):
+        if self.current_stage == "focus":
+            self.cycles += 1
+            if self.cycles % 4 == 0:
+                self.current_stage = "long_break"
+                message = f"Focus session ended. Take a long break for {self.long_break} minutes!"
+            else:
+                self.current_stage = "short_break"
+                message = f"Focus session ended. Take a short break for {self.short_break} minutes!"
+        else:
+            self.current_stage = "focus"
+            message = f"Break ended. Focus for {self.focus} minutes!"
+        # Chain off the previous deadline rather than the current time so a late wakeup
+        # doesn't push every following stage back.
+        self.deadline += self.stage_length()
+        return message
 
 class Pomodoro(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.sessions = {}
+        # Groups whose session is being set up. Claimed before the first await, so a second
+        # start for the same group is turned away instead of hitting the one-active-session
+        # index.
+        self.starting = set()
+        self.scheduler = DeadlineScheduler(self.on_stage_end, 'pomodoro')
+
+    async def cog_load(self):
+        await self.restore_sessions()
+        self.scheduler.start()
+
+    async def restore_sessions(self):
+        rows = await self.bot.db.get_active_pomodoro_sessions()
+        now = time.monotonic()
+        for row in rows:
+            session = PomodoroSession.from_row(row)
+            self.sessions[session.group_id] = session
+            if session.is_paused:
+                continue
+            # Skip any stages that finished while the bot was down instead of announcing each one
+            while session.deadline <= now:
+                session.advance()
+            self.scheduler.schedule(session.group_id, session.deadline)
+        if rows:
+            print(f"Restored {len(rows)} Pomodoro sessions")
+
+    async def save_session(self, session):
+        await self.bot.db.update_pomodoro_session(session.session_id, session.current_stage, session.cycles,
+                                                  session.stage_deadline(), session.paused_remaining)
+
+    async def cog_unload(self):
+        self.scheduler.stop()
+
+    def stop_sessions(self, group_ids):
+        # The groups are being deleted; their session rows are closed along with them
+        for group_id in group_ids:
+            self.scheduler.cancel(group_id)
+            self.sessions.pop(group_id, None)
+            self.starting.discard(group_id)
 
     @app_commands.command(name="start_pomodoro", description="Start a Pomodoro session for the study group")
     @app_commands.describe(
@@ -26,119 +128,139 @@ class Pomodoro(commands.Cog):
         short_break="Short break duration in minutes",
         long_break="Long break duration in minutes"
     )
-    async def start_pomodoro(self, interaction: discord.Interaction, focus: int = 25, short_break: int = 5, long_break: int = 15):
-        group = await self.bot.db.get_user_group(interaction.user.id)
+    async def start_pomodoro(self, interaction: discord.Interaction, focus: app_commands.Range[int, 1, 240] = 25,
+                             short_break: app_commands.Range[int, 1, 240] = 5, long_break: app_commands.Range[int, 1, 240] = 15):
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
         if not group:
             await interaction.response.send_message("You're not in any study group.", ephemeral=True)
             return
 
-        if group[0] in self.sessions:
+        if group.id in self.sessions or group.id in self.starting:
             await interaction.response.send_message("A Pomodoro session is already in progress for this group.", ephemeral=True)
             return
 
-        session = PomodoroSession(group[0], focus, short_break, long_break)
-        self.sessions[group[0]] = session
+        self.starting.add(group.id)
+        try:
+            await self.start_session(interaction, group, focus, short_break, long_break)
+        finally:
+            self.starting.discard(group.id)
 
-        voice_channel_id = group[8]  # Assuming voice_channel_id is at index 8
-        if not voice_channel_id:
-            voice_channel = await interaction.guild.create_voice_channel(f"{group[1]} VC")
-            await self.bot.db.update_voice_channel(group[0], voice_channel.id)
-        else:
-            voice_channel = interaction.guild.get_channel(voice_channel_id)
+    async def start_session(self, interaction, group, focus, short_break, long_break):
+        session = PomodoroSession(interaction.guild_id, group.id, focus, short_break, long_break)
+
+        voice_channel = interaction.guild.get_channel(group.voice_channel_id) if group.voice_channel_id else None
+        if not voice_channel:
+            # Creating the channel waits its turn in the guild's action queue, which can take
+            # longer than the interaction deadline during a burst
+            await interaction.response.defer()
+            voice_channel = await self.bot.actions.submit(
+                interaction.guild_id, lambda: interaction.guild.create_voice_channel(f"{group.name} VC"))
+            await self.bot.db.update_voice_channel(group.id, voice_channel.id)
+            # Counted like a channel made with /create_vc
+            await self.bot.db.log_vc_creation(interaction.guild_id, group.id, voice_channel.id, interaction.user.id)
+            await self.bot.db.record_stats(interaction.guild_id, group.id, (interaction.user.id,), vcs_created=1)
+        send = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
 
         if interaction.user.voice:
-            await interaction.user.move_to(voice_channel)
+            self.bot.actions.submit(interaction.guild_id, lambda: interaction.user.move_to(voice_channel),
+                                    key=('move', interaction.user.id))
         else:
-            await interaction.response.send_message(f"Please join the voice channel {voice_channel.mention} to start the Pomodoro session.", ephemeral=True)
+            await send(f"Please join the voice channel {voice_channel.mention} to start the Pomodoro session.", ephemeral=True)
             return
 
-        await interaction.response.send_message(f"Pomodoro session started! Focus for {focus} minutes.")
-        self.run_timer.start(interaction.guild_id, group[0])
+        session.start()
+        session.session_id = await self.bot.db.create_pomodoro_session(
+            interaction.guild_id, group.id, focus, short_break, long_break, session.stage_deadline())
+        if group.id not in self.starting:
+            # The group ended while the session was being saved
+            await self.bot.db.end_pomodoro_session(session.session_id)
+            await send("The study group has ended.", ephemeral=True)
+            return
+        self.sessions[group.id] = session
+        self.scheduler.schedule(group.id, session.deadline)
+        await send(f"Pomodoro session started! Focus for {focus} minutes.")
 
     @app_commands.command(name="end_pomodoro", description="End the current Pomodoro session")
     async def end_pomodoro(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_user_group(interaction.user.id)
-        if not group or group[0] not in self.sessions:
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
+        if not group or group.id not in self.sessions:
             await interaction.response.send_message("No active Pomodoro session for your group.", ephemeral=True)
             return
 
-        self.run_timer.stop()
-        del self.sessions[group[0]]
+        self.scheduler.cancel(group.id)
+        session = self.sessions.pop(group.id)
         await interaction.response.send_message("Pomodoro session ended.")
+        await self.bot.db.end_pomodoro_session(session.session_id)
 
     @app_commands.command(name="pause_pomodoro", description="Pause the current Pomodoro session")
     async def pause_pomodoro(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_user_group(interaction.user.id)
-        if not group or group[0] not in self.sessions:
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
+        if not group or group.id not in self.sessions:
             await interaction.response.send_message("No active Pomodoro session for your group.", ephemeral=True)
             return
 
-        session = self.sessions[group[0]]
+        session = self.sessions[group.id]
         if session.is_paused:
             await interaction.response.send_message("Session is already paused.", ephemeral=True)
             return
 
-        session.is_paused = True
+        session.pause()
+        self.scheduler.cancel(group.id)
         await interaction.response.send_message("Pomodoro session paused.")
+        await self.save_session(session)
 
     @app_commands.command(name="resume_pomodoro", description="Resume the paused Pomodoro session")
     async def resume_pomodoro(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_user_group(interaction.user.id)
-        if not group or group[0] not in self.sessions:
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
+        if not group or group.id not in self.sessions:
             await interaction.response.send_message("No active Pomodoro session for your group.", ephemeral=True)
             return
 
-        session = self.sessions[group[0]]
+        session = self.sessions[group.id]
         if not session.is_paused:
             await interaction.response.send_message("Session is not paused.", ephemeral=True)
             return
 
-        session.is_paused = False
+        session.resume()
+        self.scheduler.schedule(group.id, session.deadline)
         await interaction.response.send_message("Pomodoro session resumed.")
+        await self.save_session(session)
 
-    @tasks.loop(seconds=1)
-    async def run_timer(self, guild_id, group_id):
-        session = self.sessions[group_id]
-        if session.is_paused:
+    async def on_stage_end(self, group_id):
+        session = self.sessions.get(group_id)
+        if not session or session.is_paused:
             return
 
-        if session.timer is None:
-            session.timer = session.focus * 60
-
-        session.timer -= 1
-
-        if session.timer <= 0:
-            if session.current_stage == "focus":
-                session.cycles += 1
-                if session.cycles % 4 == 0:
-                    session.current_stage = "long_break"
-                    session.timer = session.long_break * 60
-                    await self.send_notification(guild_id, group_id, f"Focus session ended. Take a long break for {session.long_break} minutes!")
-                else:
-                    session.current_stage = "short_break"
-                    session.timer = session.short_break * 60
-                    await self.send_notification(guild_id, group_id, f"Focus session ended. Take a short break for {session.short_break} minutes!")
-            else:
-                session.current_stage = "focus"
-                session.timer = session.focus * 60
-                await self.send_notification(guild_id, group_id, f"Break ended. Focus for {session.focus} minutes!")
+        finished_focus = session.current_stage == "focus"
+        message = session.advance()
+        self.scheduler.schedule(group_id, session.deadline)
+        await self.save_session(session)
+        if finished_focus:
+            await self.record_focus(session)
+        await self.send_notification(session.guild_id, group_id, message)
+
+    async def record_focus(self, session):
+        # Every member of the group is credited with the finished focus stage
+        state = await self.bot.db.get_guild_state(session.guild_id)
+        group = state.groups.get(session.group_id)
+        members = group.members if group else ()
+        await self.bot.db.record_stats(session.guild_id, session.group_id, members, focus_minutes=session.focus, cycles=1)
 
     async def send_notification(self, guild_id, group_id, message):
         guild = self.bot.get_guild(guild_id)
         if guild:
-            group = await self.bot.db.get_study_group(guild_id)
+            state = await self.bot.db.get_guild_state(guild_id)
+            group = state.groups.get(group_id)
             if group:
-                _, session_role_id = await self.bot.db.get_group_roles(group[0])
-                session_role = guild.get_role(session_role_id)
+                session_role = guild.get_role(group.session_role_id)
                 if session_role:
-                    voice_channel_id = group[8]  # Assuming voice_channel_id is at index 8
-                    voice_channel = guild.get_channel(voice_channel_id)
-                    if voice_channel:
-                        await voice_channel.send(f"{session_role.mention} {message}")
-                    else:
-                        # Fallback to the first text channel if voice channel is not found
-                        channel = guild.text_channels[0]
-                        await channel.send(f"{session_role.mention} {message}")
+                    channel = guild.get_channel(group.voice_channel_id) if group.voice_channel_id else None
+                    # Fallback to a text channel if the voice channel is not found
+                    channel = channel or self.bot.notifications.fallback_channel(guild)
+                    if channel:
+                        # Keyed by group, so a stage message still queued when the next
+                        # stage starts is replaced rather than sent late
+                        await self.bot.notifications.notify(channel, ('pomodoro', group_id), f"{session_role.mention} {message}")
 
 async def setup(bot):
     await bot.add_cog(Pomodoro(bot))
\ No newline at end of file
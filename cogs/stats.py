@@ -0,0 +1,64 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import time
+from database import stats_day
+
+METRICS = {
+    "focus_minutes": "Focus minutes",
+    "cycles": "Pomodoro cycles",
+    "vcs_created": "Voice channels created",
+    "tasks_completed": "Tasks completed",
+}
+LEADERBOARD_SIZE = 10
+
+def since(days):
+    # Today counts as the first day
+    return stats_day(time.time() - (days - 1) * 86400)
+
+def format_stats(stats):
+    return "\n".join(f"{label}: {getattr(stats, metric)}" for metric, label in METRICS.items())
+
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.command(name="stats", description="Show study statistics")
+    @app_commands.guild_only()
+    @app_commands.describe(user="Whose statistics to show (defaults to you)", days="How many days back to count")
+    async def stats(self, interaction: discord.Interaction, user: discord.Member = None, days: app_commands.Range[int, 1, 365] = 7):
+        user = user or interaction.user
+        since_day = since(days)
+        guild_id = interaction.guild_id
+
+        embed = discord.Embed(title=f"Statistics for the last {days} days", color=discord.Color.blue())
+        embed.add_field(name=user.display_name, value=format_stats(await self.bot.db.get_stats(guild_id, 'user', user.id, since_day)), inline=False)
+        group = await self.bot.db.get_user_group(guild_id, user.id)
+        if group:
+            embed.add_field(name=f"Group: {group.name}", value=format_stats(await self.bot.db.get_stats(guild_id, 'group', group.id, since_day)), inline=False)
+        embed.add_field(name="Server", value=format_stats(await self.bot.db.get_stats(guild_id, 'guild', guild_id, since_day)), inline=False)
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="leaderboard", description="Show the top members of this server")
+    @app_commands.guild_only()
+    @app_commands.describe(metric="What to rank by", days="How many days back to count")
+    @app_commands.choices(metric=[app_commands.Choice(name=label, value=metric) for metric, label in METRICS.items()])
+    async def leaderboard(self, interaction: discord.Interaction, metric: str = "focus_minutes", days: app_commands.Range[int, 1, 365] = 7):
+        rows = await self.bot.db.get_leaderboard(interaction.guild_id, metric, since(days), LEADERBOARD_SIZE)
+        title = f"{METRICS[metric]} leaderboard, last {days} days"
+        if not rows:
+            await interaction.response.send_message(f"Nothing recorded for the {METRICS[metric].lower()} leaderboard yet.", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        users = await self.bot.user_resolver.resolve(interaction.guild, [row.user_id for row in rows])
+        lines = []
+        for rank, row in enumerate(rows, start=1):
+            user = users.get(row.user_id)
+            name = user.display_name if user else f"Unknown user ({row.user_id})"
+            lines.append(f"{rank}. {name}: {row.total}")
+        embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.blue())
+        await interaction.followup.send(embed=embed)
+
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
@@ -1,132 +1,269 @@
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 import asyncio
-from utils import is_manager, is_group_creator
+import time
+from cache import GroupState
+from utils import is_manager, is_group_creator, iter_mentioned_member_ids, fan_out
+
+GROUP_DURATION = 43200  # seconds a study group lasts before it expires (12 hours)
+EXPIRY_INTERVAL = 60  # seconds between sweeps for expired groups
+EXPIRY_BATCH = 100  # expired groups torn down per database round trip
+
+async def group_autocomplete(interaction: discord.Interaction, current: str):
+    state = await interaction.client.db.get_guild_state(interaction.guild_id)
+    current = current.casefold()
+    names = [group.name for group in state.groups.values() if current in group.name.casefold()]
+    return [app_commands.Choice(name=name, value=name) for name in names[:25]]
 
 class StudyGroups(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Groups between the /create_group checks and their rows committing, so concurrent
+        # creates can't reuse a name or creator: (guild_id, casefolded name) and (guild_id, user_id)
+        self.creating_names = set()
+        self.creating_users = set()
+
+    async def cog_load(self):
+        self.expire_groups.start()
+
+    async def cog_unload(self):
+        self.expire_groups.cancel()
+
+    def pick_group(self, state, name):
+        # With a single group in the server the name can be left out
+        if name:
+            return state.find_group(name)
+        if len(state.groups) == 1:
+            return next(iter(state.groups.values()))
+        return None
 
     async def create_session_role(self, guild, session_name):
         role_name = f"In {session_name}"
-        return await guild.create_role(name=role_name, mentionable=True)
+        return await self.bot.actions.submit(guild.id, lambda: guild.create_role(name=role_name, mentionable=True))
 
     @app_commands.command(name="create_group", description="Create a new study group")
     @app_commands.describe(name="Name of the study group", max_size="Maximum number of members")
     @is_manager()
     async def create_group(self, interaction: discord.Interaction, name: str, max_size: int = 10):
-        existing_group = await self.bot.db.get_study_group(interaction.guild_id)
-        if existing_group:
-            await interaction.response.send_message("A study group already exists in this server.", ephemeral=True)
+        state = await self.bot.db.get_guild_state(interaction.guild_id)
+        user_key = (interaction.guild_id, interaction.user.id)
+        if state.user_group(interaction.user.id) or user_key in self.creating_users:
+            await interaction.response.send_message("You're already in a study group. Leave your current group first.", ephemeral=True)
+            return
+
+        name_key = (interaction.guild_id, name.casefold())
+        if state.find_group(name) or name_key in self.creating_names:
+            await interaction.response.send_message("A study group with that name already exists in this server.", ephemeral=True)
             return
 
-        end_time = asyncio.get_event_loop().time() + 43200  # 12 hours
-        group_id = await self.bot.db.create_study_group(name, interaction.user.id, max_size, end_time, interaction.guild_id)
-        await self.bot.db.add_group_member(group_id, interaction.user.id)
+        self.creating_names.add(name_key)
+        self.creating_users.add(user_key)
+        try:
+            # Creating the roles can outlast the interaction deadline during a burst
+            await interaction.response.defer(thinking=True)
 
-        admin_role = await interaction.guild.create_role(name=f"Study Group: {name}")
-        session_role = await self.create_session_role(interaction.guild, name)
+            end_time = time.time() + GROUP_DURATION
+            group_id = await self.bot.db.create_study_group(name, interaction.user.id, max_size, end_time, interaction.guild_id)
+            await self.bot.db.add_group_member(group_id, interaction.user.id)
+        finally:
+            self.creating_names.discard(name_key)
+            self.creating_users.discard(user_key)
+
+        guild = interaction.guild
+        admin_role, session_role = await asyncio.gather(
+            self.bot.actions.submit(guild.id, lambda: guild.create_role(name=f"Study Group: {name}")),
+            self.create_session_role(guild, name),
+        )
         
-        await interaction.user.add_roles(admin_role, session_role)
+        self.bot.actions.add_role(interaction.user, admin_role)
+        self.bot.actions.add_role(interaction.user, session_role)
 
         await self.bot.db.update_group_roles(group_id, admin_role.id, session_role.id)
 
-        await interaction.response.send_message(
+        await interaction.followup.send(
             f"Study group '{name}' created! Use /join_group to join.\n"
             f"You've been assigned the role {session_role.mention}. "
             f"You can use this role to check progress in the session."
         )
 
-    @app_commands.command(name="join_group", description="Join the existing study group")
-    async def join_group(self, interaction: discord.Interaction):
-        user_group = await self.bot.db.get_user_group(interaction.user.id)
-        if user_group:
+    @app_commands.command(name="join_group", description="Join a study group")
+    @app_commands.describe(group="Name of the study group (optional if there is only one)")
+    @app_commands.autocomplete(group=group_autocomplete)
+    async def join_group(self, interaction: discord.Interaction, group: str = None):
+        # Everything is read from the cached guild state; the only query is the insert
+        state = await self.bot.db.get_guild_state(interaction.guild_id)
+        if state.user_group(interaction.user.id) or (interaction.guild_id, interaction.user.id) in self.creating_users:
             await interaction.response.send_message("You're already in a study group. Leave your current group first.", ephemeral=True)
             return
 
-        group = await self.bot.db.get_study_group(interaction.guild_id)
+        group = self.pick_group(state, group)
         if not group:
-            await interaction.response.send_message("No study group exists in this server.", ephemeral=True)
+            message = "No study group exists in this server." if not state.groups else "Please choose which study group to join."
+            await interaction.response.send_message(message, ephemeral=True)
             return
 
-        members = await self.bot.db.get_group_members(group[0])
-        if len(members) >= group[3]:  # max_size
+        if len(group.members) >= group.max_size:
             await interaction.response.send_message("This group is full.", ephemeral=True)
             return
 
-        await self.bot.db.add_group_member(group[0], interaction.user.id)
+        state.claim(group, interaction.user.id)
+        try:
+            await self.bot.db.add_group_member(group.id, interaction.user.id)
+        except Exception:
+            state.release(group, interaction.user.id)
+            raise
 
-        _, session_role_id = await self.bot.db.get_group_roles(group[0])
-        session_role = interaction.guild.get_role(session_role_id)
+        # Role and voice changes are queued so a burst of joins doesn't hold up the replies
+        session_role = interaction.guild.get_role(group.session_role_id)
 
         if session_role:
-            await interaction.user.add_roles(session_role)
+            self.bot.actions.add_role(interaction.user, session_role)
 
-        voice_channel_id = group[8]  # Assuming voice_channel_id is at index 8
-        if voice_channel_id:
-            voice_channel = interaction.guild.get_channel(voice_channel_id)
-            if voice_channel:
-                await interaction.user.move_to(voice_channel)
+        if group.voice_channel_id:
+            voice_channel = interaction.guild.get_channel(group.voice_channel_id)
+            if voice_channel and interaction.user.voice:
+                member = interaction.user
+                self.bot.actions.submit(interaction.guild_id, lambda: member.move_to(voice_channel), key=('move', member.id))
 
         await interaction.response.send_message(
-            f"You've joined the study group '{group[1]}'!\n"
+            f"You've joined the study group '{group.name}'!\n"
             f"You've been assigned the role {session_role.mention}. "
             f"You can use this role to check progress in the session."
         )
 
-    @app_commands.command(name="leave_group", description="Leave the current study group")
-    async def leave_group(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_study_group(interaction.guild_id)
+    @app_commands.command(name="add_members", description="Add mentioned users and roles to a study group")
+    @app_commands.describe(mentions="Users and/or roles to add", group="Name of the study group (optional if there is only one)")
+    @app_commands.autocomplete(group=group_autocomplete)
+    @is_manager()
+    async def add_members(self, interaction: discord.Interaction, mentions: str, group: str = None):
+        state = await self.bot.db.get_guild_state(interaction.guild_id)
+        group = self.pick_group(state, group)
         if not group:
-            await interaction.response.send_message("No study group exists in this server.", ephemeral=True)
+            message = "No study group exists in this server." if not state.groups else "Please choose which study group to add members to."
+            await interaction.response.send_message(message, ephemeral=True)
+            return
+
+        await interaction.response.send_message("Adding members...", ephemeral=True)
+        guild = interaction.guild
+        session_role = guild.get_role(group.session_role_id)
+
+        async def add_chunk(member_ids):
+            # Seats are claimed before awaiting so concurrent chunks and joins can't overfill
+            # the group. Members already in any group here are skipped, since users are in
+            # one at a time.
+            capacity = group.max_size - len(group.members)
+            member_ids = [member_id for member_id in member_ids
+                          if member_id not in state.user_groups and (guild.id, member_id) not in self.creating_users][:max(capacity, 0)]
+            if not member_ids:
+                return
+            for member_id in member_ids:
+                state.claim(group, member_id)
+            try:
+                await self.bot.db.add_group_members(group.id, member_ids)
+            except Exception:
+                for member_id in member_ids:
+                    state.release(group, member_id)
+                raise
+            if session_role:
+                for member_id in member_ids:
+                    member = guild.get_member(member_id)
+                    if member:
+                        self.bot.actions.add_role(member, session_role)
+
+        async def report(processed):
+            await interaction.edit_original_response(content=f"Processed {processed} members...")
+
+        try:
+            await fan_out(iter_mentioned_member_ids(guild, mentions), add_chunk, progress=report)
+        except Exception as e:
+            print(f"Failed to add members to study group {group.id}: {e}")
+            await interaction.edit_original_response(
+                content=f"Something went wrong while adding members. Study group '{group.name}' has {len(group.members)} members.")
             return
+        full = " The group is now full." if len(group.members) >= group.max_size else ""
+        await interaction.edit_original_response(content=f"Study group '{group.name}' now has {len(group.members)} members.{full}")
 
-        members = await self.bot.db.get_group_members(group[0])
-        if interaction.user.id not in members:
+    @app_commands.command(name="leave_group", description="Leave the current study group")
+    async def leave_group(self, interaction: discord.Interaction):
+        state = await self.bot.db.get_guild_state(interaction.guild_id)
+        group = state.user_group(interaction.user.id)
+        if not group:
             await interaction.response.send_message("You're not in a study group.", ephemeral=True)
             return
 
-        await self.bot.db.remove_group_member(group[0], interaction.user.id)
+        await self.bot.db.remove_group_member(group.id, interaction.user.id)
         
-        _, session_role_id = await self.bot.db.get_group_roles(group[0])
-        session_role = interaction.guild.get_role(session_role_id)
+        session_role = interaction.guild.get_role(group.session_role_id)
         
         if session_role:
-            await interaction.user.remove_roles(session_role)
+            self.bot.actions.remove_role(interaction.user, session_role)
         
-        await interaction.response.send_message(f"You've left the study group '{group[1]}'.")
+        await interaction.response.send_message(f"You've left the study group '{group.name}'.")
 
-        updated_members = await self.bot.db.get_group_members(group[0])
-        if not updated_members:
-            await self.end_group(interaction.guild_id)
+        if not group.members:
+            await self.end_group(group)
 
-    @app_commands.command(name="end_group", description="End the current study group")
+    @app_commands.command(name="end_group", description="End your study group")
     @is_group_creator()
     async def end_group_command(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_study_group(interaction.guild_id)
+        state = await self.bot.db.get_guild_state(interaction.guild_id)
+        group = state.user_group(interaction.user.id)
         if not group:
-            await interaction.response.send_message("No study group exists in this server.", ephemeral=True)
+            await interaction.response.send_message("You're not in a study group.", ephemeral=True)
             return
 
-        await self.end_group(interaction.guild_id)
-        await interaction.response.send_message(f"The study group '{group[1]}' has been ended.")
-
-    async def end_group(self, guild_id):
-        group = await self.bot.db.get_study_group(guild_id)
-        if group:
-            admin_role_id, session_role_id = await self.bot.db.get_group_roles(group[0])
-            guild = self.bot.get_guild(guild_id)
-            
-            admin_role = guild.get_role(admin_role_id)
-            session_role = guild.get_role(session_role_id)
-            
-            if admin_role:
-                await admin_role.delete()
-            if session_role:
-                await session_role.delete()
-            
-            await self.bot.db.delete_study_group(group[0])
+        await self.end_group(group)
+        await interaction.response.send_message(f"The study group '{group.name}' has been ended.")
+
+    async def end_group(self, group):
+        await self.end_groups([group])
+
+    async def end_groups(self, groups):
+        for group in groups:
+            guild = self.bot.get_guild(group.guild_id)
+            if not guild:
+                # The bot left the guild (or it's unavailable); its roles can't be reached
+                continue
+            for role_id in (group.admin_role_id, group.session_role_id):
+                role = guild.get_role(role_id)
+                if role:
+                    self.bot.actions.submit(guild.id, role.delete)
+            channel = guild.get_channel(group.voice_channel_id) if group.voice_channel_id else None
+            if channel:
+                self.bot.actions.submit(guild.id, channel.delete, key=('delete_channel', channel.id))
+
+        group_ids = [group.id for group in groups]
+        pomodoro = self.bot.get_cog('Pomodoro')
+        if pomodoro:
+            pomodoro.stop_sessions(group_ids)
+        await self.bot.db.delete_study_groups(group_ids)
+
+    @tasks.loop(seconds=EXPIRY_INTERVAL)
+    async def expire_groups(self):
+        # end_time is indexed, so each batch is a range scan over just the expired groups
+        now = time.time()
+        expired = 0
+        # An unhandled error would stop the loop for good; whatever is left expired is
+        # picked up by the next sweep instead
+        try:
+            while True:
+                rows = await self.bot.db.get_expired_study_groups(now, EXPIRY_BATCH)
+                if not rows:
+                    break
+                await self.end_groups([GroupState(group) for group in rows])
+                expired += len(rows)
+                if len(rows) < EXPIRY_BATCH:
+                    break
+        except Exception as e:
+            print(f"Failed to end expired study groups: {e}")
+        if expired:
+            print(f"Ended {expired} expired study groups")
+
+    @expire_groups.before_loop
+    async def before_expire_groups(self):
+        # Roles and channels are looked up in the guild cache
+        await self.bot.wait_until_ready()
 
 async def setup(bot):
     await bot.add_cog(StudyGroups(bot))
\ No newline at end of file
@@ -0,0 +1,137 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+from utils import EmbedPaginator, CursorPaginator
+
+TASKS_PER_PAGE = 10
+MAX_TASKS_PER_COMMAND = 25
+MAX_DESCRIPTION_LENGTH = 200
+MAX_MESSAGE_LENGTH = 2000
+
+def parse_task_ids(text):
+    ids = []
+    for part in text.replace(',', ' ').split():
+        part = part.lstrip('#')
+        if not part.isdigit():
+            return None
+        ids.append(int(part))
+    return ids
+
+async def open_task_autocomplete(interaction: discord.Interaction, current: str):
+    tasks = await interaction.client.db.get_open_tasks(interaction.guild_id, interaction.user.id)
+    current = current.casefold()
+    choices = []
+    for task_id, description in tasks.items():
+        if current in description.casefold() or current in str(task_id):
+            choices.append(app_commands.Choice(name=f"#{task_id} {description}"[:100], value=str(task_id)))
+            if len(choices) == 25:
+                break
+    return choices
+
+class Tasks(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def record_completed(self, guild_id, user_id, count):
+        group = await self.bot.db.get_user_group(guild_id, user_id)
+        await self.bot.db.record_stats(guild_id, group.id if group else None, (user_id,), tasks_completed=count)
+
+    @app_commands.command(name="add_task", description="Add one or more tasks to your list")
+    @app_commands.guild_only()
+    @app_commands.describe(tasks="The task, or several separated by semicolons")
+    async def add_task(self, interaction: discord.Interaction, tasks: str):
+        descriptions = [task.strip()[:MAX_DESCRIPTION_LENGTH] for task in tasks.split(';') if task.strip()]
+        if not descriptions:
+            await interaction.response.send_message("Please describe the task.", ephemeral=True)
+            return
+        if len(descriptions) > MAX_TASKS_PER_COMMAND:
+            await interaction.response.send_message(f"You can add at most {MAX_TASKS_PER_COMMAND} tasks at once.", ephemeral=True)
+            return
+
+        task_ids = await self.bot.db.add_tasks(interaction.guild_id, interaction.user.id, descriptions)
+        lines = [f"#{task_id} {description}" for task_id, description in zip(task_ids, descriptions)]
+        message = "Added:\n" + "\n".join(lines)
+        if len(message) > MAX_MESSAGE_LENGTH:
+            # Many long tasks at once; the numbers alone always fit
+            message = "Added " + ", ".join(f"#{task_id}" for task_id in task_ids) + "."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @app_commands.command(name="complete_task", description="Mark one or more of your tasks as done")
+    @app_commands.guild_only()
+    @app_commands.describe(tasks="Task number, or several separated by spaces or commas")
+    @app_commands.autocomplete(tasks=open_task_autocomplete)
+    async def complete_task(self, interaction: discord.Interaction, tasks: str):
+        task_ids = parse_task_ids(tasks)
+        if not task_ids:
+            await interaction.response.send_message("Please give the task numbers shown by /list_tasks.", ephemeral=True)
+            return
+        if len(task_ids) > MAX_TASKS_PER_COMMAND:
+            await interaction.response.send_message(f"You can complete at most {MAX_TASKS_PER_COMMAND} tasks at once.", ephemeral=True)
+            return
+
+        completed = await self.bot.db.complete_tasks(interaction.guild_id, interaction.user.id, task_ids)
+        if not completed:
+            await interaction.response.send_message("None of those are open tasks of yours.", ephemeral=True)
+            return
+
+        skipped = sorted(set(task_ids) - set(completed))
+        message = "Completed " + ", ".join(f"#{task_id}" for task_id in completed) + "."
+        if skipped:
+            message += " Skipped " + ", ".join(f"#{task_id}" for task_id in skipped) + ", which aren't open tasks of yours."
+        await interaction.response.send_message(message, ephemeral=True)
+        await self.record_completed(interaction.guild_id, interaction.user.id, len(completed))
+
+    @app_commands.command(name="complete_all_tasks", description="Mark all of your open tasks as done")
+    @app_commands.guild_only()
+    async def complete_all_tasks(self, interaction: discord.Interaction):
+        completed = await self.bot.db.complete_all_tasks(interaction.guild_id, interaction.user.id)
+        if not completed:
+            await interaction.response.send_message("You have no open tasks.", ephemeral=True)
+            return
+
+        await interaction.response.send_message(f"Completed {len(completed)} tasks.", ephemeral=True)
+        await self.record_completed(interaction.guild_id, interaction.user.id, len(completed))
+
+    @app_commands.command(name="list_tasks", description="List your tasks")
+    @app_commands.guild_only()
+    @app_commands.describe(include_completed="Also show tasks you've completed")
+    async def list_tasks(self, interaction: discord.Interaction, include_completed: bool = False):
+        if include_completed:
+            await self.list_task_history(interaction)
+            return
+
+        tasks = await self.bot.db.get_open_tasks(interaction.guild_id, interaction.user.id)
+        if not tasks:
+            await interaction.response.send_message("You have no open tasks. Add one with /add_task.", ephemeral=True)
+            return
+
+        items = list(tasks.items())
+        pages = []
+        for start in range(0, len(items), TASKS_PER_PAGE):
+            lines = [f"#{task_id} {description}" for task_id, description in items[start:start + TASKS_PER_PAGE]]
+            pages.append(discord.Embed(title="Open tasks", description="\n".join(lines), color=discord.Color.blue()))
+
+        if len(pages) == 1:
+            await interaction.response.send_message(embed=pages[0], ephemeral=True)
+            return
+
+        for number, page in enumerate(pages, start=1):
+            page.set_footer(text=f"Page {number}/{len(pages)}")
+        await interaction.response.send_message(embed=pages[0], view=EmbedPaginator(interaction.user.id, pages), ephemeral=True)
+
+    async def list_task_history(self, interaction):
+        # Completed tasks pile up without bound, so history is fetched a page at a time
+        async def fetch_page(cursor):
+            rows, next_cursor = await self.bot.db.get_user_tasks(interaction.guild_id, interaction.user.id, cursor, TASKS_PER_PAGE)
+            lines = [f"{'~~' if row.completed else ''}#{row.id} {row.description}{'~~' if row.completed else ''}" for row in rows]
+            embed = discord.Embed(title="All tasks", description="\n".join(lines) or "You have no tasks.", color=discord.Color.blue())
+            embed.set_footer(text=f"Page {len(view.cursors)}")
+            return embed, next_cursor
+
+        view = CursorPaginator(interaction.user.id, fetch_page)
+        embed = await view.first_page()
+        await interaction.response.send_message(embed=embed, view=view if view.next_cursor is not None else discord.utils.MISSING,
+                                                ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(Tasks(bot))
@@ -1,67 +1,184 @@
 # cogs/voice_channels.py
 
+import time
+from datetime import datetime, timedelta
 import discord
 from discord import app_commands
-from discord.ext import commands
-from utils import is_manager, is_group_creator
+from discord.ext import commands, tasks
+from utils import is_manager, is_group_creator, parse_duration, CursorPaginator
+from metrics import metrics
+
+CLEANUP_INTERVAL = 30  # seconds between sweeps for expired empty channels
+LOGS_PER_PAGE = 10
 
 class VoiceChannels(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Empty group VCs waiting out their guild's vc_cleanup_time:
+        # channel_id -> time.monotonic() after which the channel is deleted
+        self.empty_channels = {}
+
+    async def cog_load(self):
+        self.cleanup_empty_channels.start()
+
+    async def cog_unload(self):
+        self.cleanup_empty_channels.cancel()
 
     @app_commands.command(name="create_vc", description="Create a voice channel for the study group")
     @app_commands.describe(name="Name of the voice channel (optional)")
     @is_group_creator()
     async def create_vc(self, interaction: discord.Interaction, name: str = None):
-        group = await self.bot.db.get_study_group(interaction.guild_id)
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
         if not group:
-            await interaction.response.send_message("No study group exists in this server.", ephemeral=True)
+            await interaction.response.send_message("You're not in a study group.", ephemeral=True)
             return
 
-        if group[8]:  # Assuming voice_channel_id is at index 8
+        if group.voice_channel_id:
             await interaction.response.send_message("A voice channel already exists for this group.", ephemeral=True)
             return
 
-        channel_name = name or f"{group[1]} VC"
+        channel_name = name or f"{group.name} VC"
         overwrites = {
             interaction.guild.default_role: discord.PermissionOverwrite(connect=False),
             interaction.guild.me: discord.PermissionOverwrite(connect=True, manage_channels=True)
         }
 
-        _, session_role_id = await self.bot.db.get_group_roles(group[0])
-        session_role = interaction.guild.get_role(session_role_id)
+        session_role = interaction.guild.get_role(group.session_role_id)
         if session_role:
             overwrites[session_role] = discord.PermissionOverwrite(connect=True)
 
-        channel = await interaction.guild.create_voice_channel(channel_name, overwrites=overwrites)
-        await self.bot.db.update_voice_channel(group[0], channel.id)
+        await interaction.response.defer(thinking=True)
+        guild = interaction.guild
+        channel = await self.bot.actions.submit(guild.id, lambda: guild.create_voice_channel(channel_name, overwrites=overwrites))
+        await self.bot.db.update_voice_channel(group.id, channel.id)
+        await self.bot.db.log_vc_creation(guild.id, group.id, channel.id, interaction.user.id)
+        await self.bot.db.record_stats(guild.id, group.id, (interaction.user.id,), vcs_created=1)
 
-        await interaction.response.send_message(f"Voice channel {channel.mention} created for the study group.")
+        await interaction.followup.send(f"Voice channel {channel.mention} created for the study group.")
 
     @app_commands.command(name="delete_vc", description="Delete the voice channel for the study group")
     @is_group_creator()
     async def delete_vc(self, interaction: discord.Interaction):
-        group = await self.bot.db.get_study_group(interaction.guild_id)
-        if not group or not group[8]:  # Assuming voice_channel_id is at index 8
+        group = await self.bot.db.get_user_group(interaction.guild_id, interaction.user.id)
+        if not group or not group.voice_channel_id:
             await interaction.response.send_message("No voice channel exists for this group.", ephemeral=True)
             return
 
-        channel = interaction.guild.get_channel(group[8])
+        self.empty_channels.pop(group.voice_channel_id, None)
+        channel = interaction.guild.get_channel(group.voice_channel_id)
         if channel:
-            await channel.delete()
-            await self.bot.db.update_voice_channel(group[0], None)
+            self.bot.actions.submit(interaction.guild_id, channel.delete, key=('delete_channel', channel.id))
+            await self.bot.db.update_voice_channel(group.id, None)
             await interaction.response.send_message("Voice channel deleted.")
         else:
+            await self.bot.db.update_voice_channel(group.id, None)
             await interaction.response.send_message("The voice channel no longer exists.")
 
+    @app_commands.command(name="set_vc_cleanup", description="Set how long an empty study group VC is kept before it is deleted")
+    @app_commands.describe(duration="Grace period, e.g. 10m or 1h")
+    @is_manager()
+    async def set_vc_cleanup(self, interaction: discord.Interaction, duration: str):
+        seconds = parse_duration(duration)
+        if seconds is None:
+            await interaction.response.send_message("Invalid duration. Use a format like `10m` or `1h`.", ephemeral=True)
+            return
+
+        await self.bot.db.update_vc_cleanup_time(interaction.guild_id, seconds)
+        await interaction.response.send_message(f"Empty study group voice channels will be deleted after {duration}.", ephemeral=True)
+
+    @app_commands.command(name="vc_logs", description="Show the study group voice channels created in this server")
+    @app_commands.describe(days="How many days back to show")
+    @is_manager()
+    async def vc_logs(self, interaction: discord.Interaction, days: app_commands.Range[int, 1, 365] = 30):
+        start_date = datetime.now() - timedelta(days=days)
+
+        async def fetch_page(cursor):
+            rows, next_cursor = await self.bot.db.get_vc_logs(interaction.guild_id, start_date, cursor, LOGS_PER_PAGE)
+            embed = discord.Embed(title=f"Voice channels created in the last {days} days", color=discord.Color.blue())
+            lines = [f"<#{row.channel_id}> by <@{row.creator_id}> at {str(row.create_time)[:16]}" for row in rows]
+            embed.description = "\n".join(lines) or "No voice channels were created."
+            embed.set_footer(text=f"Page {len(view.cursors)}")
+            return embed, next_cursor
+
+        view = CursorPaginator(interaction.user.id, fetch_page)
+        embed = await view.first_page()
+        await interaction.response.send_message(embed=embed, view=view if view.next_cursor is not None else discord.utils.MISSING)
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        if before.channel and not after.channel:
-            group = await self.bot.db.get_study_group(before.channel.guild.id)
-            if group and group[8] == before.channel.id:
-                if not before.channel.members:
-                    await before.channel.delete()
-                    await self.bot.db.update_voice_channel(group[0], None)
+        voice_channels = self.bot.db.voice_channels
+        left = before.channel if before.channel and before.channel.id in voice_channels else None
+        joined = after.channel if after.channel and after.channel.id in voice_channels else None
+        if (left is None and joined is None) or before.channel == after.channel:
+            # Voice state updates arrive for every member of every guild; voice_events_total
+            # shows how many of them are actually for a group VC
+            metrics.increment('voice_events_total', 'filtered')
+            return
+
+        metrics.increment('voice_events_total', 'handled')
+        if joined:
+            self.empty_channels.pop(joined.id, None)
+        if left and not left.members:
+            await self.mark_empty(left)
+
+    async def mark_empty(self, channel):
+        # Deleting on the spot means a quick leave/rejoin deletes and recreates the channel,
+        # so empty channels get the guild's grace period first
+        state = await self.bot.db.get_guild_state(channel.guild.id)
+        self.empty_channels.setdefault(channel.id, time.monotonic() + state.vc_cleanup_time)
+
+    @tasks.loop(seconds=CLEANUP_INTERVAL)
+    async def cleanup_empty_channels(self):
+        now = time.monotonic()
+        expired = [channel_id for channel_id, deadline in self.empty_channels.items() if deadline <= now]
+        if not expired:
+            return
+
+        channels = []
+        group_ids = []
+        cleared = []
+        for channel_id in expired:
+            del self.empty_channels[channel_id]
+            group_id = self.bot.db.voice_channels.get_group_id(channel_id)
+            if group_id is None:
+                continue
+            channel = self.bot.get_channel(channel_id)
+            if channel and channel.members:
+                continue
+            if channel:
+                channels.append(channel)
+            group_ids.append(group_id)
+            cleared.append(channel_id)
+
+        for channel in channels:
+            self.bot.actions.submit(channel.guild.id, channel.delete, key=('delete_channel', channel.id))
+        try:
+            await self.bot.db.clear_voice_channels(group_ids)
+        except Exception as e:
+            # An unhandled error would stop the loop for good; retry on the next sweep instead
+            print(f"Failed to clear {len(group_ids)} deleted voice channels: {e}")
+            for channel_id in cleared:
+                self.empty_channels.setdefault(channel_id, now)
+
+    @cleanup_empty_channels.before_loop
+    async def reconcile_voice_channels(self):
+        # Startup sweep: forget channels deleted while the bot was down and start the
+        # grace period for ones that are sitting empty
+        await self.bot.wait_until_ready()
+        missing = []
+        for row in await self.bot.db.get_group_voice_channels():
+            guild = self.bot.get_guild(row.guild_id)
+            if guild is None:
+                # Not our guild, or unavailable right now; either way we can't tell
+                continue
+            channel = guild.get_channel(row.voice_channel_id)
+            if channel is None:
+                missing.append(row.id)
+            elif not channel.members:
+                await self.mark_empty(channel)
+        if missing:
+            await self.bot.db.clear_voice_channels(missing)
+            print(f"Cleared {len(missing)} voice channels that no longer exist")
 
 async def setup(bot):
     await bot.add_cog(VoiceChannels(bot))
\ No newline at end of file
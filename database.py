@@ -1,284 +1,958 @@
 import sqlite3
 import asyncio
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from cache import PermissionCache, GuildStateCache, GuildState, GroupState, VoiceChannelIndex, OpenTaskCache, TTLCache, shard_for
+from metrics import metrics, current_operation
+from models import (Query, columns, StudyGroup, GroupMember, GroupRoles, GroupVoiceChannel, VoiceChannelLog,
+                    PomodoroSessionRecord, GuildSettings, Manager, Task, CheckinSchedule, Stats, LeaderboardEntry)
+
+# MIGRATIONS[n] upgrades a database from user_version n to n + 1. Existing files are
+# upgraded in place on connect, so only ever append to this list.
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    # Safe under WAL: a power loss can only roll back the last commits, never corrupt
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 5000',
+]
+
+# Bot developers are global, but with the shards split across processes another process
+# can add one after load_managers; a user who isn't one is re-checked after this many seconds
+BOT_DEVELOPER_RECHECK = 60
+
+# Prepared statements kept per connection. The fixed queries below all fit with room
+# to spare for the ones whose placeholder count varies (bulk task adds and completes).
+STATEMENT_CACHE_SIZE = 256
+
+# Reader connections only ever query; WAL lets them run alongside the writer
+READER_PRAGMAS = [
+    'PRAGMA query_only = ON',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 5000',
+]
+
+MIGRATIONS = [
+    # 1: initial schema
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS study_groups (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            max_size INTEGER NOT NULL,
+            end_time REAL NOT NULL,
+            guild_id INTEGER NOT NULL,
+            admin_role_id INTEGER,
+            session_role_id INTEGER,
+            voice_channel_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER,
+            user_id INTEGER,
+            FOREIGN KEY (group_id) REFERENCES study_groups (id),
+            PRIMARY KEY (group_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS pomodoro_sessions (
+            id INTEGER PRIMARY KEY,
+            group_id INTEGER,
+            start_time REAL,
+            end_time REAL,
+            focus_duration INTEGER,
+            short_break_duration INTEGER,
+            long_break_duration INTEGER,
+            FOREIGN KEY (group_id) REFERENCES study_groups (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS managers (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER,
+            permission_level INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS voice_channel_logs (
+            id INTEGER PRIMARY KEY,
+            group_id INTEGER,
+            channel_id INTEGER,
+            creator_id INTEGER,
+            create_time TIMESTAMP,
+            FOREIGN KEY (group_id) REFERENCES study_groups (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER PRIMARY KEY,
+            vc_cleanup_time INTEGER DEFAULT 600,
+            vc_category_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            completed BOOLEAN NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 2: indexes for the hot lookups, and one manager row per (user, guild) so that
+    # INSERT OR REPLACE in add_manager actually replaces
+    [
+        'CREATE INDEX IF NOT EXISTS idx_study_groups_guild ON study_groups (guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_vc_logs_group_time ON voice_channel_logs (group_id, create_time)',
+        '''
+        DELETE FROM managers WHERE id NOT IN (
+            SELECT MAX(id) FROM managers GROUP BY user_id, guild_id
+        )
+        ''',
+        # NULLs are distinct in a plain unique index, so bot developers (NULL guild) are keyed on 0
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_managers_user_guild ON managers (user_id, IFNULL(guild_id, 0))',
+        'CREATE INDEX IF NOT EXISTS idx_managers_guild ON managers (guild_id)',
+    ],
+    # 3: enough Pomodoro state to resume a running session after a restart. stage_deadline
+    # is wall-clock time; end_time stays NULL while the session is active.
+    [
+        'ALTER TABLE pomodoro_sessions ADD COLUMN guild_id INTEGER',
+        'ALTER TABLE pomodoro_sessions ADD COLUMN stage TEXT NOT NULL DEFAULT \'focus\'',
+        'ALTER TABLE pomodoro_sessions ADD COLUMN cycles INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE pomodoro_sessions ADD COLUMN stage_deadline REAL',
+        'ALTER TABLE pomodoro_sessions ADD COLUMN paused_remaining REAL',
+        # Sessions written before this migration can't be resumed
+        'UPDATE pomodoro_sessions SET end_time = start_time WHERE end_time IS NULL',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_pomodoro_sessions_active ON pomodoro_sessions (group_id) WHERE end_time IS NULL',
+    ],
+    # 4: many groups per guild, so membership is also looked up by user
+    [
+        'CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id)',
+    ],
+    # 5: study_groups.end_time used to be the event loop's monotonic clock, which means
+    # nothing after a restart. It is wall-clock time now, and old groups get a fresh
+    # 12 hours from the migration rather than being torn down on the spot.
+    [
+        "UPDATE study_groups SET end_time = CAST(strftime('%s', 'now') AS REAL) + 43200 WHERE end_time < 1000000000",
+        'CREATE INDEX IF NOT EXISTS idx_study_groups_end_time ON study_groups (end_time)',
+    ],
+    # 6: per-day statistics rollups, kept up to date as things happen so stats and
+    # leaderboards read a handful of buckets instead of the raw history. scope is
+    # 'guild', 'group' or 'user' and scope_id the matching ID; day is a UTC YYYY-MM-DD.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_rollups (
+            guild_id INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            scope_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            focus_minutes INTEGER NOT NULL DEFAULT 0,
+            cycles INTEGER NOT NULL DEFAULT 0,
+            vcs_created INTEGER NOT NULL DEFAULT 0,
+            tasks_completed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, scope, scope_id, day)
+        ) WITHOUT ROWID
+        ''',
+        # Leaderboards read every user's buckets in a date range
+        'CREATE INDEX IF NOT EXISTS idx_stats_rollups_day ON stats_rollups (guild_id, scope, day)',
+    ],
+    # 7: tasks belong to the guild they were added in. Task history is paged per user and
+    # guild, and open tasks get a partial index of their own.
+    [
+        'ALTER TABLE tasks ADD COLUMN guild_id INTEGER',
+        'DROP INDEX IF EXISTS idx_tasks_user',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_guild ON tasks (user_id, guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_open ON tasks (user_id, guild_id) WHERE completed = 0',
+    ],
+    # 8: check-ins. A schedule row per user who asked for reminders (intervals in
+    # seconds), and one row per check-in they post.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS checkin_schedules (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            min_interval INTEGER NOT NULL,
+            max_interval INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS checkins (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_checkins_user ON checkins (guild_id, user_id, created_at)',
+    ],
+    # 9: voice channel logs carry their guild, so they outlive the study group (which
+    # is deleted when it ends) and are paged per guild without a join. Logs whose group
+    # is already gone can't be attributed and keep a NULL guild_id.
+    [
+        'ALTER TABLE voice_channel_logs ADD COLUMN guild_id INTEGER',
+        'UPDATE voice_channel_logs SET guild_id = (SELECT guild_id FROM study_groups WHERE study_groups.id = voice_channel_logs.group_id)',
+        'CREATE INDEX IF NOT EXISTS idx_vc_logs_guild ON voice_channel_logs (guild_id, id)',
+    ],
+    # 10: the leaderboard index covers the metric columns, so a date range is read from
+    # the index alone. The planner still prefers the primary key (every bucket of every
+    # user in the guild's history), so LEADERBOARDS names this index explicitly.
+    [
+        'DROP INDEX IF EXISTS idx_stats_rollups_day',
+        'CREATE INDEX IF NOT EXISTS idx_stats_rollups_leaderboard ON stats_rollups '
+        '(guild_id, scope, day, scope_id, focus_minutes, cycles, vcs_created, tasks_completed)',
+    ],
+]
+
+STATS_METRICS = ('focus_minutes', 'cycles', 'vcs_created', 'tasks_completed')
+
+def stats_day(timestamp=None):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+DEFAULT_VC_CLEANUP_TIME = 600
+
+# Read queries
+STUDY_GROUP = Query(f'SELECT {columns(StudyGroup)} FROM study_groups WHERE id = ?', StudyGroup)
+GUILD_STUDY_GROUPS = Query(f'SELECT {columns(StudyGroup)} FROM study_groups WHERE guild_id = ?', StudyGroup)
+ALL_STUDY_GROUPS = Query(f'SELECT {columns(StudyGroup)} FROM study_groups', StudyGroup)
+GUILD_GROUP_MEMBERS = Query(f'''
+SELECT {columns(GroupMember, 'group_members')} FROM group_members
+JOIN study_groups ON group_members.group_id = study_groups.id
+WHERE study_groups.guild_id = ?
+''', GroupMember)
+ALL_GROUP_MEMBERS = Query(f'SELECT {columns(GroupMember)} FROM group_members', GroupMember)
+GROUP_MEMBER_IDS = Query('SELECT user_id FROM group_members WHERE group_id = ?')
+USER_GROUP_ID = Query('''
+SELECT study_groups.id FROM group_members
+JOIN study_groups ON group_members.group_id = study_groups.id
+WHERE group_members.user_id = ? AND study_groups.guild_id = ?
+''')
+GROUP_ROLES = Query(f'SELECT {columns(GroupRoles)} FROM study_groups WHERE id = ?', GroupRoles)
+GROUP_VOICE_CHANNELS = Query(f'SELECT {columns(GroupVoiceChannel)} FROM study_groups WHERE voice_channel_id IS NOT NULL', GroupVoiceChannel)
+VC_LOGS = Query(f'''
+SELECT {columns(VoiceChannelLog)} FROM voice_channel_logs
+WHERE guild_id = ? AND create_time >= ? AND id < ?
+ORDER BY id DESC
+LIMIT ?
+''', VoiceChannelLog)
+ACTIVE_POMODORO_SESSIONS = Query(f'SELECT {columns(PomodoroSessionRecord)} FROM pomodoro_sessions WHERE end_time IS NULL', PomodoroSessionRecord)
+GUILD_SETTINGS = Query(f'SELECT {columns(GuildSettings)} FROM guild_settings WHERE guild_id = ?', GuildSettings)
+# Only guilds that have study groups get their state loaded up front
+STUDY_GROUP_GUILD_SETTINGS = Query(f'''
+SELECT {columns(GuildSettings)} FROM guild_settings
+WHERE guild_id IN (SELECT guild_id FROM study_groups)
+''', GuildSettings)
+MANAGERS = Query(f'SELECT {columns(Manager)} FROM managers', Manager)
+BOT_DEVELOPER = Query(f'SELECT {columns(Manager)} FROM managers WHERE user_id = ? AND guild_id IS NULL', Manager)
+MANAGER = Query(f'SELECT {columns(Manager)} FROM managers WHERE user_id = ? AND (guild_id = ? OR guild_id IS NULL)', Manager)
+GUILD_MANAGERS = Query(f'SELECT {columns(Manager)} FROM managers WHERE guild_id = ? OR guild_id IS NULL', Manager)
+OPEN_TASKS = Query(f'SELECT {columns(Task)} FROM tasks WHERE user_id = ? AND guild_id = ? AND completed = 0 ORDER BY id', Task)
+USER_TASKS = Query(f'SELECT {columns(Task)} FROM tasks WHERE user_id = ? AND guild_id = ? AND id > ? ORDER BY id LIMIT ?', Task)
+CHECKIN_SCHEDULES = Query(f'SELECT {columns(CheckinSchedule)} FROM checkin_schedules', CheckinSchedule)
+STATS = Query(f'''
+SELECT {', '.join(f'IFNULL(SUM({metric}), 0)' for metric in Stats._fields)}
+FROM stats_rollups
+WHERE guild_id = ? AND scope = ? AND scope_id = ? AND day >= ?
+''', Stats)
+# One per metric, since the column can't be a parameter
+LEADERBOARDS = {metric: Query(f'''
+SELECT scope_id, SUM({metric}) AS total
+FROM stats_rollups INDEXED BY idx_stats_rollups_leaderboard
+WHERE guild_id = ? AND scope = 'user' AND day >= ?
+GROUP BY scope_id
+HAVING total > 0
+ORDER BY total DESC
+LIMIT ?
+''', LeaderboardEntry) for metric in STATS_METRICS}
 
 class Database:
-    def __init__(self, db_name='bot_database.sqlite'):
+    def __init__(self, db_name='bot_database.sqlite', batch_window=0.01, batch_size=100, shard_count=None, shard_ids=None, readers=4):
         self.db_name = db_name
         self.conn = None
         self.lock = asyncio.Lock()
+        # sqlite3 blocks on execute/commit (and on fsync), so the write connection lives
+        # on one dedicated thread and the event loop only ever awaits its results.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        # Reads run on their own connections, one per reader thread, so a slow query
+        # only holds up the reader it runs on rather than every other call.
+        self.reader_count = readers
+        self.readers = queue.SimpleQueue()
+        self.reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='database-reader')
+        # Bumped each time a write batch finishes; see _read_for_cache
+        self.write_generation = 0
+        # Writes arriving within batch_window seconds (or until batch_size of them are
+        # queued) are committed together, so a burst costs one fsync instead of one each.
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.pending_writes = []
+        self.writes_waiting = asyncio.Event()
+        self.batch_full = asyncio.Event()
+        self.writer_task = None
+        self.writing = []  # futures of the batch on the database thread right now
+        self.closed = False
+        # Set when this process runs only some of the bot's shards. State for guilds on
+        # other shards is neither loaded nor swept here; their own process handles it.
+        self.shard_count = shard_count
+        self.shard_ids = set(shard_ids) if shard_ids is not None else None
+        expired = f'SELECT {columns(StudyGroup)} FROM study_groups WHERE end_time <= ?'
+        if self.shard_ids is not None:
+            shards = ', '.join(str(shard_id) for shard_id in sorted(self.shard_ids))
+            expired += f' AND (guild_id >> 22) % {shard_count} IN ({shards})'
+        self.expired_groups_query = Query(expired + ' ORDER BY end_time LIMIT ?', StudyGroup)
+        self.permissions = PermissionCache()
+        # Users found not to be bot developers, re-checked once the entry expires
+        self.bot_developer_checks = TTLCache(ttl=BOT_DEVELOPER_RECHECK)
+        self.guild_states = GuildStateCache(shard_count=shard_count or 1)
+        self.guild_state_loads = {}
+        self.open_tasks = OpenTaskCache()
+        # Every managed group VC in every guild, so voice events for other channels can
+        # be dropped without a lookup
+        self.voice_channels = VoiceChannelIndex()
+
+    def owns_guild(self, guild_id):
+        if self.shard_ids is None or guild_id is None:
+            return True
+        return shard_for(guild_id, self.shard_count) in self.shard_ids
+
+    async def _run(self, func, *args):
+        # Runs on the write connection. Attributed to the public method that made the call.
+        operation = current_operation.get() or func.__name__
+        start = time.perf_counter()
+        async with self.lock:
+            acquired = time.perf_counter()
+            metrics.observe('db_wait_seconds', operation, acquired - start)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.executor, func, *args)
+            finally:
+                metrics.observe('db_execute_seconds', operation, time.perf_counter() - acquired)
+
+    async def _read(self, func, *args):
+        # Runs func(conn, *args) on a free reader connection
+        operation = current_operation.get() or func.__name__
+        submitted = time.perf_counter()
+        started = []
+
+        def run():
+            started.append(time.perf_counter())
+            conn = self.readers.get()
+            try:
+                return func(conn, *args)
+            finally:
+                self.readers.put(conn)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.reader_executor, run)
+        finally:
+            if started:
+                metrics.observe('db_wait_seconds', operation, started[0] - submitted)
+                metrics.observe('db_execute_seconds', operation, time.perf_counter() - started[0])
+
+    async def _read_for_cache(self, func, *args):
+        # For reads whose result goes into a write-through cache. A write batch that
+        # finished while the read was running may be missing from the snapshot, and its
+        # cache update had nothing to update yet, so the read is redone on the write
+        # connection, where it can't overlap a write and is cached in the same step the
+        # lock is released.
+        generation = self.write_generation
+        result = await self._read(func, *args)
+        if self.write_generation == generation:
+            return result
+        return await self._run(func, self.conn, *args)
+
+    # The *_sync helpers only ever run on the database thread
+    def _connect_sync(self):
+        # Transactions are managed explicitly by _write_batch_sync
+        self.conn = sqlite3.connect(self.db_name, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+        self.conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+
+    def _open_readers_sync(self):
+        # Opened after migrating so they never see an older schema. Each connection is
+        # used by one reader thread at a time, but not always the same one.
+        for _ in range(self.reader_count):
+            conn = sqlite3.connect(self.db_name, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            for pragma in READER_PRAGMAS:
+                conn.execute(pragma)
+            self.readers.put(conn)
+
+    def _migrate_sync(self):
+        # Several shard processes can start against the same file at once. Each step takes
+        # the write lock up front (BEGIN IMMEDIATE) and reads user_version under it, so a
+        # step another process already applied is seen and skipped rather than run twice.
+        while True:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    self.conn.execute('COMMIT')
+                    return
+                for statement in MIGRATIONS[version]:
+                    self.conn.execute(statement)
+                self.conn.execute(f'PRAGMA user_version = {version + 1}')
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            print(f"Database migrated to schema version {version + 1}")
+
+    def _close_sync(self):
+        while not self.readers.empty():
+            self.readers.get().close()
+        self.conn.close()
+        self.conn = None
+
+    # Read helpers take the connection to run on, so they work on a reader or the writer
+    @staticmethod
+    def _query_sync(conn, query, params):
+        cursor = conn.cursor()
+        cursor.row_factory = query.factory
+        return cursor.execute(query.sql, params)
+
+    def _fetchone_sync(self, conn, query, params):
+        return self._query_sync(conn, query, params).fetchone()
+
+    def _fetchall_sync(self, conn, query, params):
+        return self._query_sync(conn, query, params).fetchall()
+
+    def _write_batch_sync(self, batch):
+        # Each queued write gets its own savepoint so one failing write doesn't take the
+        # rest of the batch down with it; the whole batch shares a single commit.
+        results = []
+        try:
+            self.conn.execute('BEGIN')
+            for statements, future in batch:
+                cursor = self.conn.cursor()
+                self.conn.execute('SAVEPOINT write')
+                try:
+                    for query, params in statements:
+                        # A list of parameter tuples runs the statement once per tuple
+                        if isinstance(params, list):
+                            cursor.executemany(query, params)
+                        else:
+                            cursor.execute(query, params)
+                    # A write ending in a RETURNING statement resolves to its rows, which
+                    # have to be read here on the database thread
+                    result = cursor.fetchall() if cursor.description else cursor
+                except Exception as e:
+                    self.conn.execute('ROLLBACK TO write')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                self.conn.execute('RELEASE write')
+            self.conn.execute('COMMIT')
+        except Exception as e:
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            return [(future, None, e) for _, future in batch]
+        return results
+
+    async def _writer(self):
+        # Started from connect(), so drop that label; batches are timed as _write_batch_sync
+        current_operation.set(None)
+        while True:
+            await self.writes_waiting.wait()
+            if not self.pending_writes:
+                # close() wakes the writer with nothing left queued to stop it
+                return
+            if len(self.pending_writes) < self.batch_size and not self.closed:
+                try:
+                    await asyncio.wait_for(self.batch_full.wait(), self.batch_window)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self.pending_writes[:self.batch_size]
+            del self.pending_writes[:self.batch_size]
+            if not self.pending_writes and not self.closed:
+                self.writes_waiting.clear()
+            if len(self.pending_writes) < self.batch_size:
+                self.batch_full.clear()
+
+            self.writing = [future for _, future in batch]
+            results = await self._run(self._write_batch_sync, batch)
+            self.writing = []
+            self.write_generation += 1
+            for future, cursor, error in results:
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(cursor)
+
+    def _queue_write(self, statements):
+        # Nothing would ever commit it, so fail now rather than hand back a future that
+        # never resolves
+        if self.closed:
+            raise sqlite3.ProgrammingError("Cannot write to a closed database")
+        future = asyncio.get_running_loop().create_future()
+        self.pending_writes.append((statements, future))
+        self.writes_waiting.set()
+        if len(self.pending_writes) >= self.batch_size:
+            self.batch_full.set()
+        return future
+
+    async def flush(self):
+        # Waits for every write queued so far, including the batch already being committed
+        futures = self.writing + [future for _, future in self.pending_writes]
+        if futures:
+            self.batch_full.set()
+            await asyncio.gather(*futures, return_exceptions=True)
+
+    # The loaders read in one transaction, so their queries all see the same snapshot
+    def _load_guild_state_sync(self, conn, guild_id):
+        conn.execute('BEGIN')
+        try:
+            groups = self._query_sync(conn, GUILD_STUDY_GROUPS, (guild_id,)).fetchall()
+            members = self._query_sync(conn, GUILD_GROUP_MEMBERS, (guild_id,)).fetchall()
+            settings = self._query_sync(conn, GUILD_SETTINGS, (guild_id,)).fetchone()
+        finally:
+            conn.execute('COMMIT')
+        return groups, members, settings
+
+    def _load_all_guild_states_sync(self, conn):
+        conn.execute('BEGIN')
+        try:
+            groups = self._query_sync(conn, ALL_STUDY_GROUPS, ()).fetchall()
+            members = self._query_sync(conn, ALL_GROUP_MEMBERS, ()).fetchall()
+            settings = self._query_sync(conn, STUDY_GROUP_GUILD_SETTINGS, ()).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        return groups, members, settings
+
+    async def _fetchone(self, query, params=(), for_cache=False):
+        read = self._read_for_cache if for_cache else self._read
+        return await read(self._fetchone_sync, query, params)
+
+    async def _fetchall(self, query, params=(), for_cache=False):
+        read = self._read_for_cache if for_cache else self._read
+        return await read(self._fetchall_sync, query, params)
+
+    async def _execute(self, query, params=()):
+        # Resolves once the write has been committed
+        return await self._queue_write([(query, params)])
+
+    async def _execute_many(self, query, params_list):
+        return await self._queue_write([(query, list(params_list))])
+
+    async def _execute_all(self, statements):
+        return await self._queue_write(statements)
 
     async def connect(self):
-        self.conn = sqlite3.connect(self.db_name)
-        self.conn.row_factory = sqlite3.Row
-        await self.create_tables()
+        await self._run(self._connect_sync)
+        await self.migrate()
+        await self._run(self._open_readers_sync)
+        self.writer_task = asyncio.create_task(self._writer())
 
-    async def create_tables(self):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS study_groups (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                creator_id INTEGER NOT NULL,
-                max_size INTEGER NOT NULL,
-                end_time REAL NOT NULL,
-                guild_id INTEGER NOT NULL,
-                admin_role_id INTEGER,
-                session_role_id INTEGER,
-                voice_channel_id INTEGER
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS group_members (
-                group_id INTEGER,
-                user_id INTEGER,
-                FOREIGN KEY (group_id) REFERENCES study_groups (id),
-                PRIMARY KEY (group_id, user_id)
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pomodoro_sessions (
-                id INTEGER PRIMARY KEY,
-                group_id INTEGER,
-                start_time REAL,
-                end_time REAL,
-                focus_duration INTEGER,
-                short_break_duration INTEGER,
-                long_break_duration INTEGER,
-                FOREIGN KEY (group_id) REFERENCES study_groups (id)
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS managers (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                guild_id INTEGER,
-                permission_level INTEGER NOT NULL
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS voice_channel_logs (
-                id INTEGER PRIMARY KEY,
-                group_id INTEGER,
-                channel_id INTEGER,
-                creator_id INTEGER,
-                create_time TIMESTAMP,
-                FOREIGN KEY (group_id) REFERENCES study_groups (id)
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS guild_settings (
-                guild_id INTEGER PRIMARY KEY,
-                vc_cleanup_time INTEGER DEFAULT 600,
-                vc_category_id INTEGER
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                description TEXT NOT NULL,
-                completed BOOLEAN NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-
-            self.conn.commit()
+    async def warm_up(self):
+        # Fill the caches the first commands after a restart would otherwise load on demand
+        await asyncio.gather(self.load_managers(), self.load_voice_channels(), self.load_guild_states())
+
+    async def migrate(self):
+        await self._run(self._migrate_sync)
 
     async def close(self):
+        self.closed = True
+        if self.writer_task:
+            # Rather than cancelling it mid-batch, let the writer commit what is queued,
+            # resolve those futures and return
+            self.writes_waiting.set()
+            self.batch_full.set()
+            await self.writer_task
+            self.writer_task = None
         if self.conn:
-            self.conn.close()
+            await self._run(self._close_sync)
+        self.executor.shutdown(wait=True)
+        self.reader_executor.shutdown(wait=True)
+
+    # Guild state methods
+    async def get_guild_state(self, guild_id):
+        state = self.guild_states.get(guild_id)
+        if state is not None:
+            return state
+        # Concurrent misses for the same guild share a single load
+        load = self.guild_state_loads.get(guild_id)
+        if load is None:
+            load = asyncio.ensure_future(self._load_guild_state(guild_id))
+            self.guild_state_loads[guild_id] = load
+            load.add_done_callback(lambda _: self.guild_state_loads.pop(guild_id, None))
+        return await asyncio.shield(load)
+
+    async def _load_guild_state(self, guild_id):
+        groups, members, settings = await self._read_for_cache(self._load_guild_state_sync, guild_id)
+        # Cached before yielding to the loop, so any write whose results arrive after
+        # this finds the state in the cache and updates it (see _read_for_cache).
+        group_members = {}
+        for member in members:
+            group_members.setdefault(member.group_id, []).append(member.user_id)
+        state = GuildState(guild_id, [GroupState(group, group_members.get(group.id, ())) for group in groups])
+        if settings:
+            state.vc_cleanup_time = settings.vc_cleanup_time
+            state.vc_category_id = settings.vc_category_id
+        self.guild_states.put(state)
+        return state
+
+    async def load_guild_states(self):
+        # Every guild with a study group, in one pass rather than three queries per guild
+        groups, members, settings = await self._read_for_cache(self._load_all_guild_states_sync)
+        group_members = {}
+        for member in members:
+            group_members.setdefault(member.group_id, []).append(member.user_id)
+        states = {}
+        for group in groups:
+            if not self.owns_guild(group.guild_id):
+                continue
+            state = states.get(group.guild_id)
+            if state is None:
+                state = states[group.guild_id] = GuildState(group.guild_id)
+            state.add_group(GroupState(group, group_members.get(group.id, ())))
+        for guild_settings in settings:
+            state = states.get(guild_settings.guild_id)
+            if state:
+                state.vc_cleanup_time = guild_settings.vc_cleanup_time
+                state.vc_category_id = guild_settings.vc_category_id
+        for state in states.values():
+            # Guilds already loaded on demand may have newer state than this snapshot
+            if self.guild_states.peek(state.guild_id) is None:
+                self.guild_states.put(state)
 
     # Study group methods
     async def create_study_group(self, name, creator_id, max_size, end_time, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT INTO study_groups (name, creator_id, max_size, end_time, guild_id, admin_role_id, session_role_id, voice_channel_id)
-            VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL)
-            ''', (name, creator_id, max_size, end_time, guild_id))
-            group_id = cursor.lastrowid
-            self.conn.commit()
-            return group_id
-
-    async def get_study_group(self, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM study_groups WHERE guild_id = ?', (guild_id,))
-            return cursor.fetchone()
+        cursor = await self._execute('''
+        INSERT INTO study_groups (name, creator_id, max_size, end_time, guild_id, admin_role_id, session_role_id, voice_channel_id)
+        VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL)
+        ''', (name, creator_id, max_size, end_time, guild_id))
+        group_id = cursor.lastrowid
+        self.guild_states.add_group(GroupState(StudyGroup(group_id, name, creator_id, max_size, end_time, guild_id, None, None, None)))
+        return group_id
+
+    async def get_study_group(self, group_id):
+        return await self._fetchone(STUDY_GROUP, (group_id,))
+
+    async def get_guild_study_groups(self, guild_id):
+        return await self._fetchall(GUILD_STUDY_GROUPS, (guild_id,))
+
+    async def get_user_group(self, guild_id, user_id):
+        # O(1) from the user -> group map once the guild is cached; otherwise a single
+        # indexed lookup rather than loading the whole guild up front
+        state = self.guild_states.get(guild_id)
+        if state is not None:
+            return state.user_group(user_id)
+        group_id = await self._fetchone(USER_GROUP_ID, (user_id, guild_id))
+        if group_id is None:
+            return None
+        state = await self.get_guild_state(guild_id)
+        return state.groups.get(group_id)
+
+    async def get_expired_study_groups(self, now, limit):
+        return await self._fetchall(self.expired_groups_query, (now, limit))
 
     async def delete_study_group(self, group_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM study_groups WHERE id = ?', (group_id,))
-            cursor.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
-            self.conn.commit()
+        await self.delete_study_groups([group_id])
+
+    async def delete_study_groups(self, group_ids):
+        if not group_ids:
+            return
+        now = time.time()
+        await self._execute_all([
+            ('DELETE FROM study_groups WHERE id = ?', [(group_id,) for group_id in group_ids]),
+            ('DELETE FROM group_members WHERE group_id = ?', [(group_id,) for group_id in group_ids]),
+            ('UPDATE pomodoro_sessions SET end_time = ? WHERE group_id = ? AND end_time IS NULL', [(now, group_id) for group_id in group_ids]),
+        ])
+        for group_id in group_ids:
+            self.guild_states.remove_group(group_id)
+            self.voice_channels.remove_group(group_id)
 
     # Group member methods
     async def add_group_member(self, group_id, user_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT OR IGNORE INTO group_members (group_id, user_id)
-            VALUES (?, ?)
-            ''', (group_id, user_id))
-            self.conn.commit()
+        await self._execute('''
+        INSERT OR IGNORE INTO group_members (group_id, user_id)
+        VALUES (?, ?)
+        ''', (group_id, user_id))
+        self.guild_states.add_members(group_id, (user_id,))
+
+    async def add_group_members(self, group_id, user_ids):
+        await self._execute_many('''
+        INSERT OR IGNORE INTO group_members (group_id, user_id)
+        VALUES (?, ?)
+        ''', [(group_id, user_id) for user_id in user_ids])
+        self.guild_states.add_members(group_id, user_ids)
 
     async def remove_group_member(self, group_id, user_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            DELETE FROM group_members
-            WHERE group_id = ? AND user_id = ?
-            ''', (group_id, user_id))
-            self.conn.commit()
+        await self._execute('''
+        DELETE FROM group_members
+        WHERE group_id = ? AND user_id = ?
+        ''', (group_id, user_id))
+        self.guild_states.remove_member(group_id, user_id)
 
     async def get_group_members(self, group_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT user_id FROM group_members WHERE group_id = ?', (group_id,))
-            return [row['user_id'] for row in cursor.fetchall()]
+        return await self._fetchall(GROUP_MEMBER_IDS, (group_id,))
 
     # Role methods
     async def update_group_roles(self, group_id, admin_role_id, session_role_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            UPDATE study_groups
-            SET admin_role_id = ?, session_role_id = ?
-            WHERE id = ?
-            ''', (admin_role_id, session_role_id, group_id))
-            self.conn.commit()
+        await self._execute('''
+        UPDATE study_groups
+        SET admin_role_id = ?, session_role_id = ?
+        WHERE id = ?
+        ''', (admin_role_id, session_role_id, group_id))
+        group = self.guild_states.get_group(group_id)
+        if group:
+            group.admin_role_id = admin_role_id
+            group.session_role_id = session_role_id
 
     async def get_group_roles(self, group_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT admin_role_id, session_role_id FROM study_groups WHERE id = ?', (group_id,))
-            return cursor.fetchone()
+        return await self._fetchone(GROUP_ROLES, (group_id,))
 
     # Voice channel methods
+    async def load_voice_channels(self):
+        self.voice_channels.load(await self._group_voice_channels(for_cache=True))
+
+    async def get_group_voice_channels(self):
+        return await self._group_voice_channels()
+
+    async def _group_voice_channels(self, for_cache=False):
+        rows = await self._fetchall(GROUP_VOICE_CHANNELS, for_cache=for_cache)
+        return [row for row in rows if self.owns_guild(row.guild_id)]
+
     async def update_voice_channel(self, group_id, voice_channel_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            UPDATE study_groups
-            SET voice_channel_id = ?
-            WHERE id = ?
-            ''', (voice_channel_id, group_id))
-            self.conn.commit()
-
-    async def log_vc_creation(self, group_id, channel_id, creator_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT INTO voice_channel_logs (group_id, channel_id, creator_id, create_time)
-            VALUES (?, ?, ?, ?)
-            ''', (group_id, channel_id, creator_id, datetime.now()))
-            self.conn.commit()
-
-    async def get_vc_logs(self, guild_id, start_date):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            SELECT channel_id, creator_id, create_time FROM voice_channel_logs
-            JOIN study_groups ON voice_channel_logs.group_id = study_groups.id
-            WHERE study_groups.guild_id = ? AND create_time >= ?
-            ''', (guild_id, start_date))
-            return cursor.fetchall()
+        await self._execute('''
+        UPDATE study_groups
+        SET voice_channel_id = ?
+        WHERE id = ?
+        ''', (voice_channel_id, group_id))
+        self.voice_channels.set(group_id, voice_channel_id)
+        group = self.guild_states.get_group(group_id)
+        if group:
+            group.voice_channel_id = voice_channel_id
+
+    async def clear_voice_channels(self, group_ids):
+        if not group_ids:
+            return
+        await self._execute_all([('UPDATE study_groups SET voice_channel_id = NULL WHERE id = ?', (group_id,)) for group_id in group_ids])
+        for group_id in group_ids:
+            self.voice_channels.remove_group(group_id)
+            group = self.guild_states.get_group(group_id)
+            if group:
+                group.voice_channel_id = None
+
+    async def log_vc_creation(self, guild_id, group_id, channel_id, creator_id):
+        await self._execute('''
+        INSERT INTO voice_channel_logs (guild_id, group_id, channel_id, creator_id, create_time)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (guild_id, group_id, channel_id, creator_id, datetime.now()))
+
+    async def get_vc_logs(self, guild_id, start_date, cursor=None, limit=20):
+        # Newest first, a page at a time. cursor is the next_cursor returned with the
+        # previous page (the last log ID on it); next_cursor is None on the last page.
+        rows = await self._fetchall(VC_LOGS, (guild_id, start_date, cursor if cursor is not None else 2 ** 63 - 1, limit + 1))
+        return self._page(rows, limit)
+
+    @staticmethod
+    def _page(rows, limit):
+        # Keyset pages fetch one row past the limit to know whether another page follows
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1].id
+        return rows, None
+
+    # Pomodoro session methods
+    async def create_pomodoro_session(self, guild_id, group_id, focus, short_break, long_break, stage_deadline):
+        cursor = await self._execute('''
+        INSERT INTO pomodoro_sessions (group_id, guild_id, start_time, focus_duration, short_break_duration, long_break_duration, stage_deadline)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (group_id, guild_id, time.time(), focus, short_break, long_break, stage_deadline))
+        return cursor.lastrowid
+
+    async def update_pomodoro_session(self, session_id, stage, cycles, stage_deadline, paused_remaining):
+        await self._execute('''
+        UPDATE pomodoro_sessions
+        SET stage = ?, cycles = ?, stage_deadline = ?, paused_remaining = ?
+        WHERE id = ?
+        ''', (stage, cycles, stage_deadline, paused_remaining, session_id))
+
+    async def end_pomodoro_session(self, session_id):
+        await self._execute('UPDATE pomodoro_sessions SET end_time = ? WHERE id = ?', (time.time(), session_id))
+
+    async def get_active_pomodoro_sessions(self):
+        rows = await self._fetchall(ACTIVE_POMODORO_SESSIONS)
+        return [row for row in rows if self.owns_guild(row.guild_id)]
 
     # Guild settings methods
     async def update_vc_cleanup_time(self, guild_id, cleanup_time):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT OR REPLACE INTO guild_settings (guild_id, vc_cleanup_time)
-            VALUES (?, ?)
-            ''', (guild_id, cleanup_time))
-            self.conn.commit()
+        # An upsert rather than INSERT OR REPLACE, which would reset vc_category_id
+        await self._execute('''
+        INSERT INTO guild_settings (guild_id, vc_cleanup_time)
+        VALUES (?, ?)
+        ON CONFLICT (guild_id) DO UPDATE SET vc_cleanup_time = excluded.vc_cleanup_time
+        ''', (guild_id, cleanup_time))
+        state = self.guild_states.peek(guild_id)
+        if state:
+            state.vc_cleanup_time = cleanup_time
+
+    async def get_guild_settings(self, guild_id):
+        settings = await self._fetchone(GUILD_SETTINGS, (guild_id,))
+        return settings or GuildSettings(guild_id, DEFAULT_VC_CLEANUP_TIME, None)
 
     async def get_vc_cleanup_time(self, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT vc_cleanup_time FROM guild_settings WHERE guild_id = ?', (guild_id,))
-            result = cursor.fetchone()
-            return result['vc_cleanup_time'] if result else 600
+        return (await self.get_guild_settings(guild_id)).vc_cleanup_time
 
     async def update_vc_category(self, guild_id, category_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT OR REPLACE INTO guild_settings (guild_id, vc_category_id)
-            VALUES (?, ?)
-            ''', (guild_id, category_id))
-            self.conn.commit()
+        await self._execute('''
+        INSERT INTO guild_settings (guild_id, vc_category_id)
+        VALUES (?, ?)
+        ON CONFLICT (guild_id) DO UPDATE SET vc_category_id = excluded.vc_category_id
+        ''', (guild_id, category_id))
+        state = self.guild_states.peek(guild_id)
+        if state:
+            state.vc_category_id = category_id
 
     async def get_vc_category(self, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT vc_category_id FROM guild_settings WHERE guild_id = ?', (guild_id,))
-            result = cursor.fetchone()
-            return result['vc_category_id'] if result else None
+        return (await self.get_guild_settings(guild_id)).vc_category_id
 
     # Manager methods
+    async def load_managers(self):
+        rows = await self._fetchall(MANAGERS, for_cache=True)
+        self.permissions.load(row for row in rows if self.owns_guild(row.guild_id))
+
+    async def is_bot_developer(self, user_id):
+        if self.permissions.is_bot_developer(user_id):
+            return True
+        if self.bot_developer_checks.get(user_id) is not None:
+            return False
+        row = await self._fetchone(BOT_DEVELOPER, (user_id,))
+        if row is None:
+            self.bot_developer_checks.put(user_id, False)
+            return False
+        self.permissions.set(row.user_id, row.guild_id, row.permission_level)
+        return True
+
     async def add_manager(self, user_id, guild_id, permission_level):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT OR REPLACE INTO managers (user_id, guild_id, permission_level)
-            VALUES (?, ?, ?)
-            ''', (user_id, guild_id, permission_level))
-            self.conn.commit()
+        await self._execute('''
+        INSERT OR REPLACE INTO managers (user_id, guild_id, permission_level)
+        VALUES (?, ?, ?)
+        ''', (user_id, guild_id, permission_level))
+        self.permissions.set(user_id, guild_id, permission_level)
 
     async def remove_manager(self, user_id, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM managers WHERE user_id = ? AND guild_id = ?', (user_id, guild_id))
-            self.conn.commit()
+        await self._execute('DELETE FROM managers WHERE user_id = ? AND guild_id = ?', (user_id, guild_id))
+        self.permissions.remove(user_id, guild_id)
 
     async def get_manager(self, user_id, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM managers WHERE user_id = ? AND (guild_id = ? OR guild_id IS NULL)', (user_id, guild_id))
-            return cursor.fetchone()
+        return await self._fetchone(MANAGER, (user_id, guild_id))
 
     async def get_all_managers(self, guild_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM managers WHERE guild_id = ? OR guild_id IS NULL', (guild_id,))
-            return cursor.fetchall()
+        return await self._fetchall(GUILD_MANAGERS, (guild_id,))
 
     # Task methods
-    async def add_task(self, user_id, description):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            INSERT INTO tasks (user_id, description)
-            VALUES (?, ?)
-            ''', (user_id, description))
-            task_id = cursor.lastrowid
-            self.conn.commit()
-            return task_id
-
-    async def complete_task(self, user_id, task_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-            UPDATE tasks SET completed = 1
-            WHERE id = ? AND user_id = ?
-            ''', (task_id, user_id))
-            self.conn.commit()
-            return cursor.rowcount > 0
-
-    async def get_user_tasks(self, user_id):
-        async with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM tasks WHERE user_id = ?', (user_id,))
-            return cursor.fetchall()
\ No newline at end of file
+    async def add_tasks(self, guild_id, user_id, descriptions):
+        # One multi-row insert, so a bulk add is a single statement in a single transaction
+        values = ', '.join('(?, ?, ?)' for _ in descriptions)
+        params = [value for description in descriptions for value in (user_id, guild_id, description)]
+        rows = await self._execute(f'INSERT INTO tasks (user_id, guild_id, description) VALUES {values} RETURNING id', tuple(params))
+        task_ids = sorted(row['id'] for row in rows)
+        self.open_tasks.add(guild_id, user_id, zip(task_ids, descriptions))
+        return task_ids
+
+    async def complete_tasks(self, guild_id, user_id, task_ids):
+        # Returns the IDs that were open and are now completed
+        placeholders = ', '.join('?' for _ in task_ids)
+        rows = await self._execute(f'''
+        UPDATE tasks SET completed = 1
+        WHERE user_id = ? AND guild_id = ? AND completed = 0 AND id IN ({placeholders})
+        RETURNING id
+        ''', (user_id, guild_id, *task_ids))
+        completed = sorted(row['id'] for row in rows)
+        self.open_tasks.remove(guild_id, user_id, completed)
+        return completed
+
+    async def complete_all_tasks(self, guild_id, user_id):
+        # One statement, so every open task is completed in the same transaction
+        rows = await self._execute('''
+        UPDATE tasks SET completed = 1
+        WHERE user_id = ? AND guild_id = ? AND completed = 0
+        RETURNING id
+        ''', (user_id, guild_id))
+        completed = sorted(row['id'] for row in rows)
+        self.open_tasks.remove(guild_id, user_id, completed)
+        return completed
+
+    async def get_open_tasks(self, guild_id, user_id):
+        # {task_id: description}, oldest first
+        tasks = self.open_tasks.get(guild_id, user_id)
+        if tasks is not None:
+            return tasks
+        rows = await self._fetchall(OPEN_TASKS, (user_id, guild_id), for_cache=True)
+        # Cached before yielding to the loop, like guild state
+        tasks = {task.id: task.description for task in rows}
+        self.open_tasks.put(guild_id, user_id, tasks)
+        return tasks
+
+    async def get_user_tasks(self, guild_id, user_id, cursor=None, limit=20):
+        # Oldest first, paged like get_vc_logs
+        rows = await self._fetchall(USER_TASKS, (user_id, guild_id, cursor or 0, limit + 1))
+        return self._page(rows, limit)
+
+    # Check-in methods
+    async def set_checkin_schedule(self, guild_id, user_id, channel_id, min_interval, max_interval):
+        await self._execute('''
+        INSERT OR REPLACE INTO checkin_schedules (guild_id, user_id, channel_id, min_interval, max_interval)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (guild_id, user_id, channel_id, min_interval, max_interval))
+
+    async def remove_checkin_schedule(self, guild_id, user_id):
+        cursor = await self._execute('DELETE FROM checkin_schedules WHERE guild_id = ? AND user_id = ?', (guild_id, user_id))
+        return cursor.rowcount > 0
+
+    async def get_checkin_schedules(self):
+        rows = await self._fetchall(CHECKIN_SCHEDULES)
+        return [row for row in rows if self.owns_guild(row.guild_id)]
+
+    async def add_checkins(self, checkins):
+        # checkins: (guild_id, user_id, response, created_at) tuples, inserted together
+        await self._execute_many('''
+        INSERT INTO checkins (guild_id, user_id, response, created_at)
+        VALUES (?, ?, ?, ?)
+        ''', checkins)
+
+    # Statistics methods
+    async def record_stats(self, guild_id, group_id, user_ids, focus_minutes=0, cycles=0, vcs_created=0, tasks_completed=0):
+        # Bumps today's guild bucket, the group's bucket (if any) and each user's, all in
+        # one transaction
+        day = stats_day()
+        counts = (focus_minutes, cycles, vcs_created, tasks_completed)
+        rows = [(guild_id, 'guild', guild_id, day, *counts)]
+        if group_id is not None:
+            rows.append((guild_id, 'group', group_id, day, *counts))
+        rows.extend((guild_id, 'user', user_id, day, *counts) for user_id in user_ids)
+        await self._execute_many('''
+        INSERT INTO stats_rollups (guild_id, scope, scope_id, day, focus_minutes, cycles, vcs_created, tasks_completed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (guild_id, scope, scope_id, day) DO UPDATE SET
+            focus_minutes = focus_minutes + excluded.focus_minutes,
+            cycles = cycles + excluded.cycles,
+            vcs_created = vcs_created + excluded.vcs_created,
+            tasks_completed = tasks_completed + excluded.tasks_completed
+        ''', rows)
+
+    async def get_stats(self, guild_id, scope, scope_id, since_day):
+        return await self._fetchone(STATS, (guild_id, scope, scope_id, since_day))
+
+    async def get_leaderboard(self, guild_id, metric, since_day, limit=10):
+        if metric not in LEADERBOARDS:
+            raise ValueError(f"Unknown stats metric: {metric}")
+        return await self._fetchall(LEADERBOARDS[metric], (guild_id, since_day, limit))
+
+# Every public coroutine method records its latency in db_call_seconds
+for _name, _method in list(vars(Database).items()):
+    if not _name.startswith('_') and asyncio.iscoroutinefunction(_method):
+        setattr(Database, _name, metrics.timed(_name, _method))
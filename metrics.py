@@ -0,0 +1,131 @@
+import bisect
+import contextvars
+import functools
+import time
+from aiohttp import web
+
+# In-process metrics. Histograms have fixed exponential buckets, so each one is a small
+# list of counters whatever the traffic, and quantiles are read off the buckets. Everything
+# records into the module-level registry below; it is rendered for /perf and in the
+# Prometheus text format for the optional metrics endpoint.
+
+# Upper bounds in seconds: 50us doubling up to ~26s, then everything slower
+BUCKETS = [0.00005 * 2 ** i for i in range(20)]
+
+HISTOGRAMS = {
+    'db_call_seconds': ('method', "Latency of Database methods, including queueing"),
+    'db_wait_seconds': ('operation', "Time spent waiting for a database connection"),
+    'db_execute_seconds': ('operation', "Time spent running on a database connection"),
+    'command_seconds': ('command', "Slash command latency from the interaction being created to the handler finishing"),
+    'scheduler_lag_seconds': ('scheduler', "How late scheduled deadlines fire"),
+    'discord_call_seconds': ('call', "Latency of queued Discord API calls"),
+}
+
+COUNTERS = {
+    'gateway_events_total': ('event', "Gateway events received"),
+    'command_errors_total': ('command', "Slash commands that ended in an error"),
+    'checkin_reminders_total': ('outcome', "Check-in reminders sent, or dropped because one was already waiting"),
+    'voice_events_total': ('outcome', "Voice state updates handled for a group VC, or filtered out"),
+    'cache_hits_total': ('cache', "Lookups answered by an in-memory cache"),
+    'cache_misses_total': ('cache', "Lookups an in-memory cache couldn't answer"),
+}
+
+# The Database method currently running in this task, so time on the database thread
+# can be attributed to it
+current_operation = contextvars.ContextVar('current_operation', default=None)
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # The upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else float('inf')
+        return float('inf')
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {name: {} for name in HISTOGRAMS}  # name -> {label: Histogram}
+        self.counters = {name: {} for name in COUNTERS}  # name -> {label: count}
+
+    def observe(self, name, label, value):
+        histograms = self.histograms[name]
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms[label] = Histogram()
+        histogram.observe(value)
+
+    def increment(self, name, label, amount=1):
+        counters = self.counters[name]
+        counters[label] = counters.get(label, 0) + amount
+
+    def timed(self, label, func):
+        # Wraps a coroutine method so each call lands in db_call_seconds
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = current_operation.set(label)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.observe('db_call_seconds', label, time.perf_counter() - start)
+                current_operation.reset(token)
+        return wrapper
+
+    def summary(self, name, limit=10):
+        # (label, count, p50, p99) for the labels with the slowest p99 first
+        rows = [(label, histogram.count, histogram.quantile(0.5), histogram.quantile(0.99))
+                for label, histogram in self.histograms[name].items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def render(self):
+        lines = []
+        for name, (label_name, help_text) in HISTOGRAMS.items():
+            lines.append(f"# HELP cpo_{name} {help_text}")
+            lines.append(f"# TYPE cpo_{name} histogram")
+            for label, histogram in self.histograms[name].items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'cpo_{name}_bucket{{{label_name}="{label}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'cpo_{name}_bucket{{{label_name}="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'cpo_{name}_sum{{{label_name}="{label}"}} {histogram.total}')
+                lines.append(f'cpo_{name}_count{{{label_name}="{label}"}} {histogram.count}')
+        for name, (label_name, help_text) in COUNTERS.items():
+            lines.append(f"# HELP cpo_{name} {help_text}")
+            lines.append(f"# TYPE cpo_{name} counter")
+            for label, count in self.counters[name].items():
+                lines.append(f'cpo_{name}{{{label_name}="{label}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    # aiohttp already comes with discord.py
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
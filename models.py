@@ -0,0 +1,72 @@
+import random
+import time
+from collections import namedtuple
+
+# Row types returned by Database. Each is a namedtuple over exactly the columns its
+# queries select, built straight from the cursor: rows kept in caches are smaller than
+# sqlite3.Row, and a missing or renamed column fails on the SELECT instead of turning
+# up as a wrong value later.
+
+class StudyGroup(namedtuple('StudyGroup', 'id name creator_id max_size end_time guild_id admin_role_id session_role_id voice_channel_id')):
+    __slots__ = ()
+
+class GroupMember(namedtuple('GroupMember', 'group_id user_id')):
+    __slots__ = ()
+
+class GroupRoles(namedtuple('GroupRoles', 'admin_role_id session_role_id')):
+    __slots__ = ()
+
+class GroupVoiceChannel(namedtuple('GroupVoiceChannel', 'id guild_id voice_channel_id')):
+    __slots__ = ()
+
+class VoiceChannelLog(namedtuple('VoiceChannelLog', 'id channel_id creator_id create_time')):
+    __slots__ = ()
+
+class PomodoroSessionRecord(namedtuple('PomodoroSessionRecord', 'id group_id guild_id focus_duration short_break_duration '
+                                                                'long_break_duration stage cycles stage_deadline paused_remaining')):
+    __slots__ = ()
+
+class GuildSettings(namedtuple('GuildSettings', 'guild_id vc_cleanup_time vc_category_id')):
+    __slots__ = ()
+
+class Manager(namedtuple('Manager', 'user_id guild_id permission_level')):
+    __slots__ = ()
+
+class Task(namedtuple('Task', 'id description completed created_at')):
+    __slots__ = ()
+
+class CheckinSchedule(namedtuple('CheckinSchedule', 'guild_id user_id channel_id min_interval max_interval')):
+    __slots__ = ()
+
+    def next_deadline(self):
+        # Random within the user's window, which also keeps reminders from bunching up
+        return time.monotonic() + random.uniform(self.min_interval, self.max_interval)
+
+class Stats(namedtuple('Stats', 'focus_minutes cycles vcs_created tasks_completed')):
+    __slots__ = ()
+
+class LeaderboardEntry(namedtuple('LeaderboardEntry', 'user_id total')):
+    __slots__ = ()
+
+def columns(model, table=None):
+    # The SELECT list for a model, qualified with the table name when given
+    prefix = f'{table}.' if table else ''
+    return ', '.join(prefix + field for field in model._fields)
+
+def first_column(cursor, row):
+    return row[0]
+
+class Query:
+    # A statement and the type its rows come back as (the first column alone when no
+    # model is given). Queries are built once, at import or in Database.__init__, so the
+    # same SQL text reaches sqlite3 every time and its per-connection statement cache
+    # skips preparing the statement again.
+    __slots__ = ('sql', 'factory')
+
+    def __init__(self, sql, model=None):
+        self.sql = ' '.join(sql.split())
+        if model is None:
+            self.factory = first_column
+        else:
+            make = model._make
+            self.factory = lambda cursor, row: make(row)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from metrics import metrics
+
+# Channel messages that can pile up (Pomodoro stage changes land in the same second for
+# every session on the default timings) go through here instead of channel.send. Each
+# channel's pending messages are sent together as one message, a few channels at a time,
+# and a message that is replaced before it goes out (same key, e.g. the next stage of
+# the same session) is dropped rather than sent late.
+
+MESSAGE_LIMIT = 2000
+
+class NotificationDispatcher:
+    def __init__(self, concurrency=8, max_pending=10000, window=0.1):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self.window = window  # seconds to wait for more messages to the same channel
+        self.pending = {}  # channel_id -> (channel, {key: content}), oldest key first
+        self.pending_count = 0
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+        self.delivering = set()  # channel IDs with a delivery task
+        self.fallback_channels = {}  # guild_id -> channel_id
+        self.sent = 0
+        self.dropped = 0
+
+    def fallback_channel(self, guild):
+        # The first text channel the bot can talk in, remembered per guild
+        channel = guild.get_channel(self.fallback_channels.get(guild.id, 0))
+        if channel and channel.permissions_for(guild.me).send_messages:
+            return channel
+        for channel in guild.text_channels:
+            if channel.permissions_for(guild.me).send_messages:
+                self.fallback_channels[guild.id] = channel.id
+                return channel
+        self.fallback_channels.pop(guild.id, None)
+        return None
+
+    async def notify(self, channel, key, content):
+        # Waits while too many messages are queued, so a flood slows its producers down
+        # instead of growing without bound
+        while self.pending_count >= self.max_pending:
+            self.has_space.clear()
+            await self.has_space.wait()
+
+        entry = self.pending.get(channel.id)
+        if entry is None:
+            entry = self.pending[channel.id] = (channel, {})
+        messages = entry[1]
+        if messages.pop(key, None) is not None:
+            self.dropped += 1
+        else:
+            self.pending_count += 1
+        messages[key] = content
+
+        if channel.id not in self.delivering:
+            self.delivering.add(channel.id)
+            asyncio.create_task(self._deliver(channel.id))
+
+    async def _deliver(self, channel_id):
+        try:
+            await asyncio.sleep(self.window)
+            async with self.semaphore:
+                # Anything queued for the channel while a send was in flight goes out next
+                while channel_id in self.pending:
+                    channel, messages = self.pending.pop(channel_id)
+                    self.pending_count -= len(messages)
+                    self.has_space.set()
+                    for content in self._chunks(messages.values()):
+                        start = time.perf_counter()
+                        try:
+                            await channel.send(content)
+                            self.sent += 1
+                        except Exception as e:
+                            print(f"Failed to send notification to channel {channel_id}: {e}")
+                        metrics.observe('discord_call_seconds', 'notification', time.perf_counter() - start)
+        finally:
+            self.delivering.discard(channel_id)
+
+    def _chunks(self, messages):
+        chunk = ""
+        for message in messages:
+            message = message[:MESSAGE_LIMIT]
+            if chunk and len(chunk) + 1 + len(message) > MESSAGE_LIMIT:
+                yield chunk
+                chunk = ""
+            chunk = f"{chunk}\n{message}" if chunk else message
+        if chunk:
+            yield chunk
@@ -0,0 +1,88 @@
+import asyncio
+import heapq
+import itertools
+import time
+from metrics import metrics
+
+# Runs callback(key) once each scheduled key's time.monotonic() deadline passes. All
+# keys share one heap and one sleeping task, so scheduling and firing are O(log n) no
+# matter how many are pending. Cancelled or rescheduled entries stay in the heap and
+# are skipped when they surface.
+class DeadlineScheduler:
+    def __init__(self, callback, name='scheduler'):
+        self.callback = callback
+        self.name = name  # label for the scheduler_lag_seconds metric
+        self.heap = []
+        self.entries = {}  # key -> sequence number of its live heap entry
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.runner = None
+        self.running = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def schedule(self, key, deadline):
+        seq = next(self.counter)
+        self.entries[key] = seq
+        heapq.heappush(self.heap, (deadline, seq, key))
+        if self.heap[0][1] == seq:
+            self.wakeup.set()
+        self._compact()
+
+    def cancel(self, key):
+        self.entries.pop(key, None)
+        self._compact()
+
+    def _compact(self):
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+
+    def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.runner:
+            self.runner.cancel()
+            self.runner = None
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            deadline, seq, key = self.heap[0]
+            if self.entries.get(key) != seq:
+                heapq.heappop(self.heap)
+                continue
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            del self.entries[key]
+            metrics.observe('scheduler_lag_seconds', self.name, -delay)
+            # Callbacks talk to Discord, so run them alongside the scheduler rather than
+            # letting one slow send hold up every other deadline.
+            task = asyncio.create_task(self._fire(key))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _fire(self, key):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            print(f"Scheduled callback for {key} failed: {e}")
@@ -1,6 +1,8 @@
 import re
+import asyncio
 import discord
-from discord.ext import commands
+from discord import app_commands
+from cache import TTLCache
 
 def parse_duration(duration_str):
     match = re.match(r'(\d+)\s*(s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?)', duration_str, re.IGNORECASE)
@@ -38,19 +40,190 @@ def parse_mentions(ctx, mentions):
     
     return list(set(members))  # Remove duplicates
 
+def iter_mentioned_member_ids(guild, mentions, chunk_size=500):
+    # Streaming counterpart to parse_mentions for large roles: yields deduplicated member
+    # IDs in chunks instead of building one list of Member objects for every mention
+    seen = set()
+    chunk = []
+    for mention in mentions.split():
+        if mention.startswith('<@&'):  # Role mention
+            role = guild.get_role(int(mention.strip('<@&>')))
+            member_ids = (member.id for member in role.members) if role else ()
+        elif mention.startswith('<@!') or mention.startswith('<@'):  # User mention
+            user_id = int(mention.strip('<@!>').strip('<@>'))
+            member_ids = (user_id,) if guild.get_member(user_id) else ()
+        else:
+            continue
+
+        for member_id in member_ids:
+            if member_id in seen:
+                continue
+            seen.add(member_id)
+            chunk.append(member_id)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+async def fan_out(chunks, action, concurrency=4, progress=None):
+    # Runs action(chunk) for each chunk with at most `concurrency` in flight. The next
+    # chunk isn't pulled from the iterator until a slot frees up, so memory stays bounded
+    # by the concurrency rather than by the total size. progress(done) is awaited after
+    # each chunk with the running count of processed IDs. If a chunk fails, no further
+    # chunks are started and the first error is raised once the running ones finish.
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+    done = 0
+    error = None
+
+    async def run(chunk):
+        nonlocal done, error
+        try:
+            await action(chunk)
+        except Exception as e:
+            if error is None:
+                error = e
+            return
+        finally:
+            semaphore.release()
+        done += len(chunk)
+        if progress:
+            # Only a progress report; a failed one shouldn't stop the work
+            try:
+                await progress(done)
+            except Exception as e:
+                print(f"Failed to report progress: {e}")
+
+    for chunk in chunks:
+        await semaphore.acquire()
+        if error is not None:
+            semaphore.release()
+            break
+        task = asyncio.create_task(run(chunk))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    # Tasks drop out of running as they finish, so wait until it's empty rather than
+    # gathering a snapshot
+    while running:
+        await asyncio.wait(running)
+    if error is not None:
+        raise error
+    return done
+
+# These decorate slash commands, so they have to be app_commands checks; commands.check
+# only applies to prefix commands and was silently ignored here.
 def is_manager():
-    async def predicate(ctx):
-        manager_cog = ctx.bot.get_cog('Manager')
+    async def predicate(interaction: discord.Interaction):
+        manager_cog = interaction.client.get_cog('Manager')
         if manager_cog:
-            permission_level = await manager_cog.get_permission_level(ctx.guild.id, ctx.author.id)
+            permission_level = await manager_cog.get_permission_level(interaction.guild_id, interaction.user.id)
             return permission_level >= manager_cog.PermissionLevel.GUILD_MANAGER
         return False
-    return commands.check(predicate)
+    return app_commands.check(predicate)
 
 def is_group_creator():
-    async def predicate(ctx):
-        manager_cog = ctx.bot.get_cog('Manager')
+    async def predicate(interaction: discord.Interaction):
+        manager_cog = interaction.client.get_cog('Manager')
         if manager_cog:
-            return await manager_cog.is_group_creator(ctx.guild.id, ctx.author.id)
+            return await manager_cog.is_group_creator(interaction.guild_id, interaction.user.id)
         return False
-    return commands.check(predicate)
\ No newline at end of file
+    return app_commands.check(predicate)
+
+class UserResolver:
+    def __init__(self, bot, concurrency=8, max_size=10000, ttl=3600):
+        self.bot = bot
+        self.cache = TTLCache(max_size, ttl)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(self, guild, user_ids):
+        # Gateway caches first, then our TTL cache, and only then the API; whatever is
+        # left is fetched concurrently. Returns {user_id: user or None}.
+        users = {}
+        missing = []
+        for user_id in set(user_ids):
+            user = (guild and guild.get_member(user_id)) or self.bot.get_user(user_id) or self.cache.get(user_id)
+            if user:
+                users[user_id] = user
+            else:
+                missing.append(user_id)
+
+        fetched = await asyncio.gather(*(self.fetch(user_id) for user_id in missing))
+        users.update(zip(missing, fetched))
+        return users
+
+    async def fetch(self, user_id):
+        async with self.semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                return None
+        self.cache.put(user_id, user)
+        return user
+
+class CursorPaginator(discord.ui.View):
+    # Like EmbedPaginator, but pages are fetched as they're shown rather than built up
+    # front. fetch_page(cursor) returns (embed, next_cursor), with next_cursor None on
+    # the last page; the first page is fetched with cursor None.
+    def __init__(self, author_id, fetch_page, timeout=180):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.fetch_page = fetch_page
+        self.cursors = [None]  # the cursor each page up to the current one was fetched with
+        self.next_cursor = None
+
+    async def first_page(self):
+        embed, self.next_cursor = await self.fetch_page(None)
+        self.update_buttons()
+        return embed
+
+    def update_buttons(self):
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.author_id
+
+    async def show(self, interaction: discord.Interaction):
+        embed, self.next_cursor = await self.fetch_page(self.cursors[-1])
+        self.update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(self.next_cursor)
+        await self.show(interaction)
+
+class EmbedPaginator(discord.ui.View):
+    def __init__(self, author_id, pages, timeout=180):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.pages = pages
+        self.index = 0
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.index >= len(self.pages) - 1
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.author_id
+
+    async def show(self, interaction: discord.Interaction):
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.pages[self.index], view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index -= 1
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.index += 1
+        await self.show(interaction)